@@ -0,0 +1,124 @@
+from stats import *
+from synthetic import generate
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stdout
+from io import StringIO
+from platform import python_version
+import json
+
+# Times the main parts of the project on made-up game data (see synthetic.py), or on a real data directory, and saves the results as JSON
+# so that runs before and after a change can be compared. Every benchmark is run a few times, and the fastest time is kept.
+
+def _archetypes(weapons): # The first weapon of each kind that behaves differently in the simulations
+    kinds = {}
+    for w in weapons:
+        if w.pellets()>1: kind = "shotgun"
+        elif w.ammo_capacity()>=75: kind = "mg"
+        elif w.burst(10)[1]<0: kind = "automatic"
+        elif w.burst(10)[1]>1: kind = "burst"
+        else: kind = "single"
+        kinds.setdefault(kind, w)
+    return kinds
+
+def _clear_caches(data): # So that every run calculates everything again, including the parts of Weapons that match_weapons shares through data
+    one_shot.cache.clear()
+    one_burst.cache.clear()
+    data.compiled.clear()
+
+def _time(function, repeat, data):
+    best = inf
+    for _ in range(repeat):
+        _clear_caches(data)
+        t0 = perf_counter()
+        function()
+        best = min(best, perf_counter()-t0)
+    return best
+
+def benchmarks(datapath, workdir, quick=False): # The Data they use, and {name: function} in the order they run
+    data = Data(datapath, cache=None)
+    weapons = match_weapons(data)
+    xs = [x*0.5 for x in range(201)]
+    out = {}
+    out["data_load"] = lambda: Data(datapath, cache=None)
+    Data(datapath, join(workdir, "cache")) # Fill the cache, so the next one only reads it
+    out["data_load_cached"] = lambda: Data(datapath, join(workdir, "cache"))
+    out["match_weapons"] = lambda: match_weapons(data)
+    for stat in ["accuracy", "crit_chance", "damage", "penetration", "aim_time", "cycle_time", "burst"]:
+        out["weapon_"+stat] = lambda stat=stat: [getattr(w, stat)(x) for w in weapons for x in xs]
+        if np is not None:
+            out["weapon_"+stat+"_array"] = lambda stat=stat: [getattr(w, stat)(np.array(xs)) for w in weapons]
+    for kind, w in _archetypes(weapons).items():
+        out["one_shot_"+kind] = lambda w=w: [one_shot(w, x, armor=(4,40)) for x in range(0,101,5)]
+        out["one_burst_"+kind] = lambda w=w: [one_burst(w, x, armor=(4,40)) for x in range(0,101,5)]
+        out["one_mag_"+kind] = lambda w=w: [one_mag(w, x, armor=(4,40)) for x in range(0,101,20)]
+    if not quick:
+        distances = x_axis(range(0,101,5), all_cutoffs(weapons))
+        makedirs(join(workdir, "output"), exist_ok=True)
+        out["stats_tables"] = lambda: write_tables(weapons, distances, join(workdir, "output"))
+    return data, out
+
+def check_bounds(weapons, approximations=(Approximation(5,5), Approximation(10,1), Approximation(1,10,1e-4))):
+    # Whether the exact results lie in the *_bounds of each approximation's, for each kind of weapon; the exact ones prune too, so it's their own
+    # bounds that have to overlap (and the exact results have to lie in those). one_mag gets timeout=0, since the bounds don't cover fights that
+    # the rounding moves across it. Returns the number of checks, and the failed ones
+    checked, failed = 0, []
+    for kind, w in _archetypes(weapons).items():
+        for x in range(0,101,20):
+            for armor in [(0,0), (4,40)]:
+                for name, function in [("one_burst", lambda b: one_burst(w, x, armor=armor, backend=b)), ("one_mag", lambda b: one_mag(w, x, armor=armor, timeout=0, backend=b))]:
+                    exact = function(Event)
+                    for backend in (Event,)+tuple(approximations):
+                        e = function(backend)
+                        for hp in [50, 75, 100]: # Up to the max_hp of the simulations, like stats.py
+                            results = [("kill_chance", (exact.kill_chance(hp),)*2 if backend is Event else exact.kill_chance_bounds(hp), e.kill_chance_bounds(hp))]
+                            results += [("kill_time %g"%pmin, (exact.kill_time(pmin, hp),)*2 if backend is Event else exact.kill_time_bounds(pmin, hp), e.kill_time_bounds(pmin, hp)) for pmin in [0.5, 0.95]]
+                            for what, (value_low, value_high), (low, high) in results:
+                                checked += 1
+                                if value_high<low-1e-9 or value_low>high+1e-9: failed.append((kind, name, x, armor, backend, hp, what, (value_low, value_high), (low, high)))
+    return checked, failed
+
+def run(datapath, workdir, repeat=3, quick=False, only=None):
+    results = {}
+    data, functions = benchmarks(datapath, workdir, quick)
+    for name, function in functions.items():
+        if only and not any(o in name for o in only): continue
+        with redirect_stdout(StringIO()):
+            results[name] = _time(function, 1 if name=="stats_tables" else repeat, data)
+        print("%-32s %10.4f s"%(name, results[name]))
+    return results
+
+def compare(results, earlier): # Ratios of the times in results to the ones in earlier (<1 is faster)
+    for name, t in results.items():
+        if name in earlier["results"]: print("%-32s %10.4f s  %6.2fx"%(name, t, t/earlier["results"][name] if earlier["results"][name]>0 else inf))
+        else: print("%-32s %10.4f s  (new)"%(name, t))
+
+if __name__=="__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Time the data loading, weapon stats, simulations and tables, and save the results as JSON.")
+    parser.add_argument("datapath", nargs="?", default=None, help="game data directory (default: made-up data from synthetic.py)")
+    parser.add_argument("--scale", type=int, default=1, help="size of the made-up data, see synthetic.py")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the made-up data")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs of each benchmark (the fastest one counts)")
+    parser.add_argument("--quick", action="store_true", help="leave out the full stats.py run")
+    parser.add_argument("--only", nargs="*", help="only run the benchmarks with any of these in their name")
+    parser.add_argument("--output", default="benchmark.json", help="file to save the results to")
+    parser.add_argument("--compare", help="results of an earlier run to compare with")
+    parser.add_argument("--check", action="store_true", help="instead of timing, check that the exact results lie in the bounds of the approximate ones")
+    args = parser.parse_args()
+    if args.check:
+        with TemporaryDirectory() as workdir:
+            checked, failed = check_bounds(match_weapons(Data(args.datapath or generate(join(workdir, "data"), args.scale, args.seed), cache=None)))
+        for f in failed: print(*f)
+        print("%d of %d results outside the bounds"%(len(failed), checked))
+        exit(1 if failed else 0)
+    with TemporaryDirectory() as workdir:
+        datapath = args.datapath or generate(join(workdir, "data"), args.scale, args.seed)
+        results = run(datapath, workdir, args.repeat, args.quick, args.only)
+    if args.compare:
+        with open(args.compare) as f: earlier = json.load(f)
+        print("\nCompared with %s:"%args.compare)
+        compare(results, earlier)
+    report = {"python":python_version(), "numpy":np is not None, "datapath":args.datapath, "scale":args.scale, "seed":args.seed, "repeat":args.repeat, "results":results}
+    with open(args.output, "w") as f: json.dump(report, f, indent=1)
+    print("Saved to", args.output)
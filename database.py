@@ -0,0 +1,153 @@
+import sqlite3
+from os import makedirs
+from os.path import dirname
+from bisect import bisect_left
+from math import inf, isinf
+from warnings import warn
+
+# Results of stats.py in an SQLite file, so questions like "what's the DPS of the M4 with Mk318 and a Holosight at 37 m?" can be answered
+# without loading the game data or simulating anything; this module doesn't import any of the others, so it's quick to load
+# Rows are keyed by Weapon.info() (weapon, ammo, scope, inCover), metric, target and distance; targets are (armor, max_hp, cover) like in stats.matchups
+
+default_target = ((0,0), 100, False) # What one_shot, one_burst and one_mag use when no target is passed
+
+_schema = """
+create table if not exists weapons (id integer primary key, weapon text not null, ammo text not null, scope text not null, in_cover integer not null,
+    unique (weapon, ammo, scope, in_cover));
+create table if not exists metrics (id integer primary key, name text not null unique, source text not null, function text not null);
+create table if not exists results (metric integer not null, weapon integer not null, piercing real not null, coverage real not null, hp real not null,
+    cover integer not null, distance real not null, value real, primary key (metric, weapon, piercing, coverage, hp, cover, distance)) without rowid;
+"""
+
+def _target(target):
+    (piercing, coverage), hp, cover = target
+    return float(piercing), float(coverage), float(hp), int(bool(cover))
+
+def _info(weapon, ammo, scope, in_cover): # As stored: no scope is "", and inCover 0 or 1
+    return weapon, ammo, "" if scope is None else scope, int(bool(in_cover))
+
+def _value(value): # As stored: a number, or NULL (with a warning) for anything that isn't one, so one odd cell doesn't lose a whole run
+    try: return float(value)
+    except (TypeError, ValueError):
+        warn("Stored %r as NULL, since it isn't a number"%(value,))
+        return None
+
+def _interpolate(xs, ys, x, margin=1e-3): # Linear between the nearest stored distances; where one of them is infinite (e.g. a kill time), the nearer one
+    # Just outside the ends (by up to margin, e.g. at 0 m, where stats.x_axis starts at 0.001 because 0 is a cutoff), the end value
+    if xs[0]-margin<=x<xs[0]: return ys[0]
+    if xs[-1]<x<=xs[-1]+margin: return ys[-1]
+    j = bisect_left(xs, x)
+    if j<len(xs) and xs[j]==x: return ys[j]
+    if j==0 or j==len(xs): raise KeyError("Distance %s is outside the stored range (%s to %s)"%(x, xs[0], xs[-1]))
+    a, b, ya, yb = xs[j-1], xs[j], ys[j-1], ys[j]
+    if ya is None or yb is None or isinf(ya) or isinf(yb): return ya if x-a<=b-x else yb
+    return ya+(yb-ya)*(x-a)/(b-a)
+
+class ResultDatabase:
+    def __init__(self, filename="output/results.sqlite"):
+        self.filename = filename
+        if dirname(filename): makedirs(dirname(filename), exist_ok=True)
+        self.connection = sqlite3.connect(filename)
+        self.connection.executescript(_schema)
+        self._ids = {} # {info or metric name: id}, for put
+
+    def commit(self): # put only adds to the current transaction, so that many rows can be written at once
+        self.connection.commit()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _weapon_id(self, info):
+        if info not in self._ids:
+            self.connection.execute("insert or ignore into weapons values (null,?,?,?,?)", info)
+            self._ids[info] = self.connection.execute("select id from weapons where weapon=? and ammo=? and scope=? and in_cover=?", info).fetchone()[0]
+        return self._ids[info]
+
+    def _metric_id(self, name, source, function):
+        self.connection.execute("insert into metrics values (null,?,?,?) on conflict (name) do update set source=excluded.source, function=excluded.function", (name, source, function))
+        if name not in self._ids: self._ids[name] = self.connection.execute("select id from metrics where name=?", (name,)).fetchone()[0]
+        return self._ids[name]
+
+    def put(self, info, metric, distances, values, target=default_target, source=None, function=""):
+        # One row of a table: values[i] is the metric at distances[i] for the weapon with this info(); source is the metric's source in stats
+        # (None for stats read from the weapon, which don't depend on the target), and function names what calculated it (e.g. one_mag or markov_mag)
+        row = (self._metric_id(metric, source or "", function), self._weapon_id(_info(*info)))+_target(target)
+        self.connection.executemany("insert or replace into results values (?,?,?,?,?,?,?,?)", [row+(float(x), _value(v)) for x, v in zip(distances, values)])
+
+    def metrics(self): # {name: (source, function)}, with source None for the stats that are read from the weapon
+        return {name:(source or None, function) for name, source, function in self.connection.execute("select name, source, function from metrics order by name")}
+
+    def _where(self, metric, weapon, ammo, scope, in_cover, target=None): # SQL and parameters for the rows that match, with values as stored; None matches anything
+        conditions, parameters = [], []
+        for column, value in [("m.name", metric), ("w.weapon", weapon), ("w.ammo", ammo), ("w.scope", scope), ("w.in_cover", in_cover)]:
+            if value is None: continue
+            conditions.append(column+"=?")
+            parameters.append(value)
+        if target is not None: # Stats read from the weapon are the same for any target
+            conditions.append("(m.source='' or (piercing=? and coverage=? and hp=? and cover=?))")
+            parameters += _target(target)
+        return " from results r join metrics m on m.id=r.metric join weapons w on w.id=r.weapon"+(" where "+" and ".join(conditions) if conditions else ""), parameters
+
+    def weapons(self, weapon=None, ammo=None, scope=None, in_cover=None, metric=None, target=None): # The info() of every matching weapon that has results (None matches any)
+        where, parameters = self._where(metric, weapon, ammo, scope, None if in_cover is None else int(bool(in_cover)), target)
+        rows = self.connection.execute("select distinct w.weapon, w.ammo, w.scope, w.in_cover"+where+" order by 1, 2, 3, 4", parameters)
+        return [(w, a, s or None, bool(c)) for w, a, s, c in rows]
+
+    def curve(self, info, metric, start=0, end=inf, target=default_target): # [(distance, value)] of everything stored between start and end
+        where, parameters = self._where(metric, *_info(*info), target)
+        return self.connection.execute("select distance, value"+where+" and distance>=? and distance<=? order by distance", parameters+[start, end]).fetchall()
+
+    def value(self, info, metric, distance, target=default_target): # The metric at any distance between the stored ones
+        curve = self.curve(info, metric, target=target)
+        if not curve: raise KeyError("No results for %s, %s"%(info, metric))
+        return _interpolate([x for x, _ in curve], [v for _, v in curve], distance)
+
+    def query(self, metric, distance, weapon=None, ammo=None, scope=None, in_cover=None, target=default_target): # {info: value} for every matching weapon
+        return {info:self.value(info, metric, distance, target) for info in self.weapons(weapon, ammo, scope, in_cover, metric, target)}
+
+    def columns(self, metric=None): # Everything (or one metric) as {column: list of values}, with scope None where there is none
+        names = ["weapon", "ammo", "scope", "in_cover", "metric", "piercing", "coverage", "hp", "cover", "distance", "value"]
+        where, parameters = self._where(metric, None, None, None, None)
+        rows = self.connection.execute("select w.weapon, w.ammo, w.scope, w.in_cover, m.name, piercing, coverage, hp, cover, distance, value"+where+" order by 1, 2, 3, 4, 5, 10", parameters).fetchall()
+        columns = {name:[row[j] for row in rows] for j, name in enumerate(names)}
+        columns["scope"] = [s or None for s in columns["scope"]]
+        columns["in_cover"] = [bool(c) for c in columns["in_cover"]]
+        columns["cover"] = [bool(c) for c in columns["cover"]]
+        return columns
+
+    def export(self, filename, metric=None): # columns() as a NumPy .npz file, for loading into other tools without SQLite
+        import numpy as np # Only needed here, so looking something up doesn't import it
+        columns = self.columns(metric)
+        columns["scope"] = ["" if s is None else s for s in columns["scope"]]
+        np.savez(filename, **{name:np.array(values) for name, values in columns.items()})
+
+if __name__=="__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Look up results that stats.py has stored, without loading the game data.")
+    parser.add_argument("metric", nargs="?", help="metric to look up (without one, list the stored metrics)")
+    parser.add_argument("distance", nargs="?", type=float, help="distance in meters (between the stored ones is interpolated)")
+    parser.add_argument("--database", default="output/results.sqlite", help="file written by stats.py")
+    parser.add_argument("--weapon", help="weapon name (default: all)")
+    parser.add_argument("--ammo", help="ammo name (default: all)")
+    parser.add_argument("--scope", help="scope name (default: all)")
+    parser.add_argument("--in-cover", type=int, choices=[0,1], help="1 for the in-cover attack types, 0 for the regular ones (default: both)")
+    parser.add_argument("--armor", type=float, nargs=2, default=default_target[0], metavar=("PIERCING", "COVERAGE"), help="target armor")
+    parser.add_argument("--hp", type=float, default=default_target[1], help="target hp")
+    parser.add_argument("--cover", action="store_true", help="target is in cover")
+    args = parser.parse_args()
+    if args.metric is not None and args.distance is None: parser.error("a metric needs a distance")
+    with ResultDatabase(args.database) as database:
+        if args.metric is None:
+            for name, (source, function) in database.metrics().items(): print(name, "(%s)"%function if function else "")
+        else:
+            target = (tuple(args.armor), args.hp, args.cover)
+            found = database.query(args.metric, args.distance, args.weapon, args.ammo, args.scope, args.in_cover, target)
+            for info, value in found.items(): print(";".join(str(c) for c in info+(value,)))
+            if not found: print("No results for these weapons and this target.")
@@ -0,0 +1,191 @@
+import numpy as np
+from simulate import *
+from simulate import _clip
+
+# Alternative Event backend that stores the outcomes as a 2-D array of probabilities, indexed by (time-t0, damage)
+# Products become 2-D convolutions (via FFT for large operands), and everything else array slices and sums
+# Use it by passing backend=DenseEvent to one_pellet/one_shot/one_burst/one_mag; it mixes freely with regular Events
+# If hp_cap is set, the last damage column holds everything at or above it (like Event.capped), and products keep it that way
+
+_fft_noise = 1e-14 # FFT round-off is of this order; anything below it is dropped again
+
+def _convolve(a, b):
+    shape = (a.shape[0]+b.shape[0]-1, a.shape[1]+b.shape[1]-1)
+    small, large = (a, b) if np.count_nonzero(a)<=np.count_nonzero(b) else (b, a)
+    ti, di = np.nonzero(small)
+    n = shape[0]*shape[1]
+    if len(ti)*large.size <= 8*n*np.log2(n+1): # Few entries: just add shifted copies
+        out = np.zeros(shape)
+        for t, d, p in zip(ti, di, small[ti,di]):
+            out[t:t+large.shape[0], d:d+large.shape[1]] += p*large
+        return out
+    out = np.fft.irfft2(np.fft.rfft2(a, shape)*np.fft.rfft2(b, shape), shape)
+    out[out<_fft_noise] = 0
+    return out
+
+def _fold(p, cap): # Move all damage at or above cap into the cap column
+    if cap is not None and p.shape[1]>cap+1:
+        p = p.copy()
+        p[:,cap] += p[:,cap+1:].sum(axis=1)
+        p = p[:,:cap+1]
+    return p
+
+def _min_cap(a, b):
+    caps = [c for c in (a, b) if c is not None]
+    return min(caps) if caps else None
+
+class DenseEvent(Event):
+    def __init__(self, t=None, d=0, p=1):
+        self.t0, self.hp_cap, self.p = 0, None, np.zeros((0,1))
+        if isinstance(t,dict): self.outcomes = t
+        elif t is not None:
+            self.t0 = int(t)
+            self.p = np.zeros((1,int(d)+1))
+            self.p[0,int(d)] = _clip(float(p))
+
+    @staticmethod
+    def from_event(ev):
+        if isinstance(ev, DenseEvent): return ev
+        dense = DenseEvent(ev.outcomes)
+        if ev.pruned: dense.pruned = ev.pruned
+        return dense
+
+    def _new(self, p, t0, cap, pruned=0): # Trims empty rows and columns, so the array stays as small as possible; pruned is as in Event._empty
+        ev = DenseEvent()
+        if pruned: ev.pruned = pruned
+        rows, cols = np.nonzero(p.any(axis=1))[0], np.nonzero(p.any(axis=0))[0]
+        if len(rows):
+            ev.t0, ev.p = t0+int(rows[0]), p[rows[0]:rows[-1]+1,:cols[-1]+1]
+        ev.hp_cap = cap
+        return ev
+
+    @property
+    def outcomes(self): # Same {(time,damage):probability} view as Event; changing it has no effect, so use the methods instead
+        ti, di = np.nonzero(self.p)
+        return {(self.t0+t,d):p for t,d,p in zip(ti.tolist(), di.tolist(), self.p[ti,di].tolist())}
+
+    @outcomes.setter
+    def outcomes(self, outcomes):
+        self.hp_cap = None
+        if not outcomes:
+            self.t0, self.p = 0, np.zeros((0,1))
+            return
+        keys = np.array(list(outcomes.keys()), dtype=np.int64)
+        self.t0 = int(keys[:,0].min())
+        self.p = np.zeros((int(keys[:,0].max())-self.t0+1, int(keys[:,1].max())+1))
+        np.add.at(self.p, (keys[:,0]-self.t0, keys[:,1]), np.array(list(outcomes.values()), dtype=float))
+
+    def add_outcome(self, time, damage, p):
+        t, d = int(time), int(damage)
+        if self.hp_cap is not None: d = min(d, self.hp_cap)
+        if not self.p.size: self.t0, self.p = t, np.zeros((1,d+1))
+        elif not (self.t0<=t<self.t0+self.p.shape[0] and d<self.p.shape[1]): # Grow the array to fit
+            t0 = min(self.t0, t)
+            p2 = np.zeros((max(self.t0+self.p.shape[0], t+1)-t0, max(self.p.shape[1], d+1)))
+            p2[self.t0-t0:self.t0-t0+self.p.shape[0], :self.p.shape[1]] = self.p
+            self.t0, self.p = t0, p2
+        self.p[t-self.t0, d] += p
+
+    def _aligned(self, other, cap):
+        if not self.p.size: return np.zeros((0,1)), _fold(other.p, cap), other.t0
+        if not other.p.size: return _fold(self.p, cap), np.zeros((0,1)), self.t0
+        t0 = min(self.t0, other.t0)
+        shape = (max(self.t0+self.p.shape[0], other.t0+other.p.shape[0])-t0, max(self.p.shape[1], other.p.shape[1]))
+        out = []
+        for ev in (self, other):
+            p = np.zeros(shape)
+            p[ev.t0-t0:ev.t0-t0+ev.p.shape[0], :ev.p.shape[1]] = ev.p
+            out.append(_fold(p, cap))
+        return out[0], out[1], t0
+
+    def __add__(self, other):
+        other = DenseEvent.from_event(other)
+        cap = _min_cap(self.hp_cap, other.hp_cap)
+        a, b, t0 = self._aligned(other, cap)
+        pruned = self.pruned+other.pruned
+        if not a.size: return self._new(b, t0, cap, pruned)
+        if not b.size: return self._new(a, t0, cap, pruned)
+        return self._new(a+b, t0, cap, pruned)
+
+    def __radd__(self, other):
+        return self+other
+
+    def __rmul__(self, p):
+        if isinstance(p, Event): return self*p
+        return self._new(self.p*p, self.t0, self.hp_cap, self.pruned*p)
+
+    def __mul__(self, other):
+        if not isinstance(other, Event):
+            return other*self
+        other = DenseEvent.from_event(other)
+        cap = _min_cap(self.hp_cap, other.hp_cap)
+        pruned = 0
+        if self.pruned or other.pruned: # Same as for Event
+            ts, to = self.total(), other.total()
+            pruned = ts*other.pruned+self.pruned*to+self.pruned*other.pruned
+        if not self.p.size or not other.p.size: return self._new(np.zeros((0,1)), 0, None, pruned)
+        return self._new(_fold(_convolve(self.p, other.p), cap), self.t0+other.t0, cap, pruned)
+
+    def __bool__(self):
+        return bool(self.p.any())
+
+    def total(self):
+        return float(self.p.sum())
+
+    def normalize(self):
+        self.p = self.p/self.total()
+
+    def normalized(self):
+        return (1/self.total())*self
+
+    def expected(self):
+        if not self: return inf, 0
+        n = 1/self.total()
+        return (float(self.p.sum(axis=1)@np.arange(self.p.shape[0]))*n+self.t0, float(self.p.sum(axis=0)@np.arange(self.p.shape[1]))*n)
+
+    def capped(self, max_hp=100):
+        cap = int(max_hp) if self.hp_cap is None else min(self.hp_cap, int(max_hp))
+        return self._new(_fold(self.p, cap), self.t0, cap, self.pruned)
+
+    def cap(self, max_hp=100):
+        ev = self.capped(max_hp)
+        self.t0, self.p, self.hp_cap = ev.t0, ev.p, ev.hp_cap
+
+    def split_by_damage(self, damage=100):
+        damage = max(int(ceil(damage)), 0)
+        alive, dead = self.p.copy(), self.p.copy()
+        alive[:,damage:] = 0
+        dead[:,:damage] = 0
+        return self._new(alive, self.t0, self.hp_cap, self.pruned), self._new(dead, self.t0, self.hp_cap)
+
+    def split_by_time(self, timeout=10000):
+        i = min(max(int(ceil(timeout))-self.t0, 0), self.p.shape[0])
+        before, after = self.p.copy(), self.p.copy()
+        before[i:] = 0
+        after[:i] = 0
+        return self._new(before, self.t0, self.hp_cap, self.pruned), self._new(after, self.t0, self.hp_cap)
+
+    def kill_chance(self, hp=100):
+        return self.split_by_damage(hp)[1].total()
+
+    def kill_times(self, pmins=(0.5,), hp=100):
+        return [self.kill_time(pmin, hp) for pmin in pmins]
+
+    def kill_time(self, pmin=0.5, hp=100): # Same as Event.kill_time
+        alive, dead = self.split_by_damage(hp)
+        cum = np.cumsum(dead.p.sum(axis=1))
+        if len(cum) and cum[-1]>=pmin: return dead.t0+int(np.argmax(cum>=pmin))
+        tp = float(cum[-1]) if len(cum) else 0
+        ti, di = np.nonzero(alive.p)
+        p = alive.p[ti,di]
+        t = (ti+alive.t0).astype(float)
+        ratio = np.where(di>0, t/np.maximum(di,1), inf)
+        order = np.argsort(ratio, kind="stable")
+        ratio, p, di = ratio[order], p[order], di[order]
+        cum = tp+np.cumsum(p)
+        hit = np.nonzero((cum>pmin) & (di>0))[0]
+        if len(hit): return float(ratio[hit[0]]*hp)
+        tp = float(cum[-1]) if len(cum) else tp
+        tmax = float(ratio[di>0].max()*hp) if (di>0).any() else 0
+        if tp>0: return tmax/tp*pmin
+        else: return inf
@@ -1,11 +1,186 @@
-from bs4 import BeautifulSoup
 from glob import glob
-from os.path import basename, splitext
+from os import makedirs, replace, stat
+from os.path import abspath, basename, dirname, join, splitext
+from argparse import ArgumentParser
+from hashlib import sha1
+from collections.abc import Mapping
+import pickle
+
+class Node: # Lightweight copy of a parsed XML element; supports the parts of BeautifulSoup's interface that are used on the game data
+    __slots__ = ("name", "attrs", "children")
+    def __init__(self, name, attrs=None, children=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.children = children or []
+    
+    @staticmethod
+    def from_soup(tag):
+        return Node(tag.name, dict(tag.attrs), [Node.from_soup(c) for c in tag.children if c.name])
+    
+    def __getitem__(self, attr):
+        return self.attrs[attr]
+    
+    def get(self, attr, default=None):
+        return self.attrs.get(attr, default)
+    
+    def has_attr(self, attr):
+        return attr in self.attrs
+    
+    def __iter__(self):
+        return iter(self.children)
+    
+    def __bool__(self):
+        return True
+    
+    def __getattr__(self, name): # node.Child is the first descendant named Child, like in BeautifulSoup
+        if name.startswith("_"): raise AttributeError(name)
+        return self.find(name)
+    
+    def _matches(self, name, attrs):
+        return self.name==name and (not attrs or all(self.attrs.get(k)==v for k,v in attrs.items()))
+    
+    def find(self, name, attrs=None):
+        for c in self.children:
+            if c._matches(name, attrs): return c
+            found = c.find(name, attrs)
+            if found is not None: return found
+    
+    def find_all(self, name, attrs=None):
+        found = []
+        for c in self.children:
+            if c._matches(name, attrs): found.append(c)
+            found += c.find_all(name, attrs)
+        return found
+    
+    def __repr__(self):
+        return "<%s %s>"%(self.name, " ".join('%s="%s"'%kv for kv in self.attrs.items()))
+    
+    def canonical(self): # The element and everything in it as text, with attributes in a fixed order; equal if (and only if) the content is
+        attrs = "".join(" %s=%r"%kv for kv in sorted(self.attrs.items()))
+        return "<%s%s>%s</%s>"%(self.name, attrs, "".join(c.canonical() for c in self.children), self.name)
+
+# Next to the scripts rather than wherever they're started from, so every run finds the same cache
+default_cache = join(dirname(abspath(__file__)), "cache")
+_CACHE_VERSION = 1 # Increase when Node or the cache entries change, so caches written by an older version are rebuilt instead of loaded
+
+def _parse(content):
+    from bs4 import BeautifulSoup # Only needed when something has to be parsed; a warm start doesn't import it
+    return Node.from_soup(BeautifulSoup(content,"xml"))
+
+# What the lazy mode keeps of each file: these elements (with everything in them), and of their attributes only the ones Weapon and Data read
+_ELEMENTS = {"Firearm", "Ammo", "Scope", "AttackType"}
+_ATTRIBUTES = {"name", "inventoryBinding", "inCoverOverride", "rangeMeters",
+               "accuracyStartDist", "accuracyEndDist", "accuracyStart", "accuracyEnd", "accuracyAdd", "critChanceAdd", "followupShotAccuracyAdd",
+               "minShots", "maxShots", "minAimTime", "maxAimTime", "minAimTime2", "maxAimTime2", "resetTime",
+               "roundsPerSecondOverride", "roundsPerSecond", "numPellets", "roundsPerMagazine", "closedBolt",
+               "guardTime", "readyTime", "reloadTime", "reloadEmptyTime", "startDist", "endDist", "start", "end", "minRange", "maxRange"}
+
+def _local(tag): # Without the namespace, like BeautifulSoup's names
+    return tag.rpartition("}")[2]
+
+def _from_element(element):
+    return Node(_local(element.tag), {k:v for k,v in element.attrib.items() if k in _ATTRIBUTES}, [_from_element(c) for c in element])
+
+def _trimmed(node):
+    return Node(node.name, {k:v for k,v in node.attrs.items() if k in _ATTRIBUTES}, [_trimmed(c) for c in node.children])
+
+def _select(node, kept): # The outermost elements in _ELEMENTS, in document order, trimmed down to the attributes in _ATTRIBUTES
+    for c in node.children:
+        if c.name in _ELEMENTS: kept.append(_trimmed(c))
+        else: _select(c, kept)
+    return kept
+
+def _extract(path): # Like _parse, but streams through the file and keeps only what _select would, so the rest never has to be held in memory
+    from xml.etree.ElementTree import iterparse, ParseError
+    try:
+        stack, kept, inside = [], [], 0
+        for event, element in iterparse(path, ("start", "end")):
+            if event=="start":
+                stack.append(element)
+                if _local(element.tag) in _ELEMENTS: inside += 1
+                continue
+            stack.pop()
+            if _local(element.tag) in _ELEMENTS:
+                inside -= 1
+                if inside==0: kept.append(_from_element(element))
+            if inside==0 and stack: del stack[-1][-1] # Done with it; it's always the last child of its parent at this point
+        return Node("[document]", {}, [Node(_local(element.tag), {}, kept)])
+    except ParseError: # Not well-formed, but BeautifulSoup might still make sense of it
+        with open(path,'rb') as f: root = _parse(f.read())
+        return Node(root.name, {}, [Node(c.name, {}, _select(c, [])) for c in root.children])
+
+class _LazyFiles(Mapping): # {name: Node} of the files in lazy mode, where each one is only read (with _extract) when it's first looked up
+    def __init__(self, xmlfiles, parsed):
+        self.paths = {splitext(basename(xf))[0]:xf for xf in xmlfiles}
+        self.nodes, self.parsed = {}, parsed
+    
+    def __getitem__(self, name):
+        if name not in self.nodes:
+            self.nodes[name] = _extract(self.paths[name])
+            self.parsed.append(name)
+        return self.nodes[name]
+    
+    def __iter__(self):
+        return iter(self.paths)
+    
+    def __len__(self):
+        return len(self.paths)
+    
+    def __contains__(self, name):
+        return name in self.paths
 
 class Data:
-    def __init__(self, datapath="data"):
+    # The parsed files are kept in a cache (one file per data directory), so they only need to be parsed again when they change
+    # Pass cache=None to bypass it, or rebuild=True to parse everything again and overwrite it
+    # With lazy=True, files are only read when they're first needed, and only the parts that Weapon uses are kept (see _extract); this doesn't use the cache
+    def __init__(self, datapath="data", cache=default_cache, rebuild=False, lazy=False):
         xmlfiles = glob(datapath+"/equipment/*.xml")
-        self.raw = {splitext(basename(xf))[0]:BeautifulSoup(open(xf,'r'),"xml") for xf in xmlfiles}
+        self.datapath = datapath
+        self.parsed, self.reused = [], []
+        self.compiled = {} # The parts of Weapons that several of them share (see Weapon._compile), so they're only built once per dataset
+        self.lazy = lazy
+        if lazy:
+            self.raw = _LazyFiles(xmlfiles, self.parsed)
+            return # The catalog is built on first use, see __getattr__
+        cachefile = join(cache, sha1(abspath(datapath).encode()).hexdigest()[:16]+".pickle") if cache else None
+        entries = {}
+        if cachefile and not rebuild:
+            try:
+                with open(cachefile,'rb') as f: version, cached = pickle.load(f)
+                if version==_CACHE_VERSION: entries = cached
+            except: pass # Missing, unreadable or from an older version; start over
+        self.raw = {}
+        changed = False
+        for xf in xmlfiles:
+            name, path, st = splitext(basename(xf))[0], abspath(xf), stat(xf)
+            size, mtime, digest, node = entries.get(path, (None, None, None, None))
+            if node is None or (size, mtime)!=(st.st_size, st.st_mtime_ns):
+                with open(xf,'rb') as f: content = f.read()
+                if node is None or digest!=sha1(content).hexdigest():
+                    node, digest = _parse(content), sha1(content).hexdigest()
+                    self.parsed.append(name)
+                else: self.reused.append(name)
+                entries[path] = (st.st_size, st.st_mtime_ns, digest, node)
+                changed = True
+            else: self.reused.append(name)
+            self.raw[name] = node
+        if cachefile and changed:
+            makedirs(cache, exist_ok=True)
+            with open(cachefile+".tmp",'wb') as f: pickle.dump((_CACHE_VERSION, entries), f, pickle.HIGHEST_PROTOCOL)
+            replace(cachefile+".tmp", cachefile)
+        self._index()
+    
+    def cache_report(self):
+        if self.lazy: return "Parsed %d of %d files so far (lazy)"%(len(self.parsed), len(self.raw))
+        return "Parsed %d files, reused %d from cache"%(len(self.parsed), len(self.reused))
+    
+    _catalog = {"_names", "_enemy", "_primary_scopes", "_ammo", "_scopes", "_attack_types", "_entries", "_ammo_for", "_scopes_for", "_classes_for", "_cover"}
+    
+    def __getattr__(self, name): # Only called for missing attributes, i.e. the catalog in lazy mode before it's built
+        if name in Data._catalog:
+            self._index()
+            return self.__dict__[name]
+        raise AttributeError(name)
 
     def item_names(self, obj="Firearm", slot=None, files=None): # None means "any"
         names = []
@@ -18,45 +193,107 @@ class Data:
             except: pass # File many not contain any equipment
         return names
 
+    # Weapon lists as (side, slot): files; player weapons are split between the regular and the CIA files
+    _weapon_files = {("Player","PrimaryWeapon"):["firearms_rifles","firearms_cia"], ("Player","SecondaryWeapon"):["firearms_pistols","firearms_pistols_cia"],
+                     ("Enemy","PrimaryWeapon"):["firearms_enemy"], ("Enemy","SecondaryWeapon"):["firearms_enemy"]}
+    
+    def _first_items(self, obj, files): # {name: element}, where the first item of that name wins (like find would)
+        items = {}
+        for fn in files:
+            try:
+                for item in self.raw[fn].Equipment.find_all(obj): items.setdefault(item["name"], item)
+            except: pass
+        return items
+    
+    def _index(self): # Look everything up once, so the list_* and find_* methods don't have to search the files again
+        self._names = {key:self.item_names(obj="Firearm", slot=key[1], files=files) for key,files in self._weapon_files.items()}
+        for slot in ["PrimaryWeaponScope", "SecondaryWeaponScope"]: self._names[slot] = self.item_names(obj="Scope", slot=slot, files=["firearm_scopes"])
+        self._names["Ammo"] = self.item_names(obj="Ammo", files=["firearm_ammo"])
+        self._enemy = set(self._names["Enemy","PrimaryWeapon"]+self._names["Enemy","SecondaryWeapon"])
+        self._primary_scopes = set(self._names["PrimaryWeaponScope"])
+        self._ammo, self._scopes = self._first_items("Ammo", ["firearm_ammo"]), self._first_items("Scope", ["firearm_scopes"])
+        self._attack_types = {}
+        try:
+            for at in self.raw["firearm_attacktypes"].FirearmAttackTypes.find_all("AttackType"): self._attack_types.setdefault(at["name"], at)
+        except: pass
+        self._entries = {}
+        for key in [("Enemy","PrimaryWeapon"), ("Enemy","SecondaryWeapon"), ("Player","PrimaryWeapon"), ("Player","SecondaryWeapon")]: # Same priority as before
+            firsts = self._first_items("Firearm", self._weapon_files[key])
+            for name in self._names[key]: self._entries.setdefault(name, firsts[name])
+        self._ammo_for, self._scopes_for, self._classes_for, self._cover = {}, {}, {}, {}
+        for name, entry in self._entries.items():
+            self._ammo_for[name] = [a["name"] for a in entry.find_all("Ammo")]
+            self._scopes_for[name] = [s["name"] for s in entry.find_all("Scope")]
+            self._classes_for[name] = [c["name"] for c in entry.find_all("ClassBinding")]
+            self._cover[name] = any([at.has_attr("inCoverOverride") for at in entry.find_all("AttackType")])
+    
     def list_weapons(self, player=True, enemy=False, primary=True, secondary=False):
         ws = []
-        if player and primary: ws+=self.item_names(obj="Firearm", slot="PrimaryWeapon", files=["firearms_rifles","firearms_cia"])
-        if player and secondary: ws+=self.item_names(obj="Firearm", slot="SecondaryWeapon", files=["firearms_pistols","firearms_pistols_cia"])
-        if enemy and primary: ws+=self.item_names(obj="Firearm", slot="PrimaryWeapon", files=["firearms_enemy"])
-        if enemy and secondary: ws+=self.item_names(obj="Firearm", slot="SecondaryWeapon", files=["firearms_enemy"])
+        if player and primary: ws+=self._names["Player","PrimaryWeapon"]
+        if player and secondary: ws+=self._names["Player","SecondaryWeapon"]
+        if enemy and primary: ws+=self._names["Enemy","PrimaryWeapon"]
+        if enemy and secondary: ws+=self._names["Enemy","SecondaryWeapon"]
         return ws
 
     def list_scopes(self, primary=True, secondary=False): # Enemies don't use scopes at all, and pistols only have iron sights
         s = []
-        if primary: s+=self.item_names(obj="Scope", slot="PrimaryWeaponScope", files=["firearm_scopes"])
-        if secondary: s+=self.item_names(obj="Scope", slot="SecondaryWeaponScope", files=["firearm_scopes"])
+        if primary: s+=self._names["PrimaryWeaponScope"]
+        if secondary: s+=self._names["SecondaryWeaponScope"]
         return s
 
     def list_ammo(self, summary=False):
-        if summary: return list({an.split('_')[0] for an in self.item_names(obj="Ammo",files=["firearm_ammo"])})
-        else: return self.item_names(obj="Ammo",files=["firearm_ammo"])
+        if summary: return list({an.split('_')[0] for an in self._names["Ammo"]})
+        else: return list(self._names["Ammo"])
+
+    def is_enemy(self, weapon):
+        return weapon in self._enemy
+    
+    def is_scope(self, scope): # Same as scope in list_scopes(), without building the list
+        return scope in self._primary_scopes
+    
+    def is_ammo(self, ammo):
+        return ammo in self._ammo
 
     def find_weapon_entry(self, weapon):
-        if weapon in self.list_weapons(False, True, True, True): return self.raw["firearms_enemy"].Equipment.find("Firearm",{"name":weapon})
-        elif weapon in self.list_weapons(True, False, True, False): return self.raw["firearms_rifles"].Equipment.find("Firearm",{"name":weapon}) or self.raw["firearms_cia"].Equipment.find("Firearm",{"name":weapon})
-        elif weapon in self.list_weapons(True, False, False, True): return self.raw["firearms_pistols"].Equipment.find("Firearm",{"name":weapon}) or self.raw["firearms_pistols_cia"].Equipment.find("Firearm",{"name":weapon})
+        return self._entries.get(weapon)
+    
+    def find_ammo(self, ammo):
+        return self._ammo.get(ammo)
+    
+    def find_scope(self, scope):
+        return self._scopes.get(scope)
+    
+    def find_attack_type(self, attack):
+        return self._attack_types.get(attack)
 
     def list_scopes_for(self, weapon):
-        return [s["name"] for s in self.find_weapon_entry(weapon).find_all("Scope")]
+        return list(self._scopes_for[weapon])
 
     def list_ammo_for(self, weapon):
-        return [a["name"] for a in self.find_weapon_entry(weapon).find_all("Ammo")]
+        return list(self._ammo_for[weapon])
     
     def list_classes_for(self, weapon):
-        return [c["name"] for c in self.find_weapon_entry(weapon).find_all("ClassBinding")]
+        return list(self._classes_for[weapon])
 
     def uses_cover(self, weapon):
-        return any([at.has_attr("inCoverOverride") for at in self.find_weapon_entry(weapon).find_all("AttackType")])
+        return self._cover[weapon]
     
+# Command line options shared by all scripts that load the game data
+def arguments(description=None):
+    parser = ArgumentParser(description=description)
+    parser.add_argument("datapath", nargs="?", default="data", help="Door Kickers 2 (or mod) data directory")
+    parser.add_argument("--cache", default=default_cache, help="directory for the parsed game data cache (default: cache, next to the scripts)")
+    parser.add_argument("--no-cache", action="store_true", help="parse all files, and don't read or write the cache")
+    parser.add_argument("--rebuild-cache", action="store_true", help="parse all files, and overwrite the cache")
+    parser.add_argument("--lazy", action="store_true", help="only read the files (and the parts of them) that are needed, without the cache")
+    return parser
+
+def load(args):
+    return Data(args.datapath, None if args.no_cache else args.cache, args.rebuild_cache, args.lazy)
+
 if __name__=="__main__":
-    from sys import argv
-    try: data = Data(argv[1])
-    except: data = Data()
+    data = load(arguments("List all relevant items in the game data.").parse_args())
+    print(data.cache_report())
     print("\nFound Primary Weapons (Player):")
     for w in data.list_weapons(True, False, True, False): print(w)
     print("\nFound Secondary Weapons (Player):")
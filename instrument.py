@@ -0,0 +1,58 @@
+from time import perf_counter
+import json
+
+# Opt-in counters and timers for finding out where the time goes (e.g. why one weapon's row takes so much longer than the others)
+# The code that is measured checks `instrument.active is not None` before doing anything else, so this costs almost nothing while it's off
+
+active = None # The Report that is being collected, if any
+
+class Report:
+    def __init__(self):
+        self.counters = {} # {name: total}, e.g. the number of calls, or the sum of sizes
+        self.peaks = {} # {name: largest value seen}
+        self.cells = {} # {(weapon, distance, task): seconds}, with weapon as the strings of Weapon.info()
+        self.started = perf_counter()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0)+n
+
+    def peak(self, name, n):
+        if n>self.peaks.get(name, n-1): self.peaks[name] = n
+
+    def time(self, weapon, distance, task, seconds):
+        key = (tuple(str(c) for c in weapon.info()), distance, task)
+        self.cells[key] = self.cells.get(key, 0)+seconds
+
+    def merge(self, other): # Adds up the results of another Report, e.g. from a worker process
+        for name, n in other.counters.items(): self.count(name, n)
+        for name, n in other.peaks.items(): self.peak(name, n)
+        for key, seconds in other.cells.items(): self.cells[key] = self.cells.get(key, 0)+seconds
+
+    def summary(self, top=20): # Everything as plain lists and dicts, with the most expensive weapons and cells first
+        weapons = {}
+        for (weapon, _, _), seconds in self.cells.items(): weapons[weapon] = weapons.get(weapon, 0)+seconds
+        cells = sorted(self.cells.items(), key=lambda c: -c[1])[:top]
+        ratios = {}
+        if self.counters.get("one_mag"): ratios["one_burst per one_mag"] = self.counters.get("one_mag bursts", 0)/self.counters["one_mag"]
+        if self.counters.get("Event.__mul__"): ratios["outcome pairs per Event.__mul__"] = self.counters.get("Event.__mul__ pairs", 0)/self.counters["Event.__mul__"]
+        return {"seconds":perf_counter()-self.started, "counters":self.counters, "peaks":self.peaks, "ratios":ratios,
+                "weapons":[{"weapon":list(w), "seconds":s} for w, s in sorted(weapons.items(), key=lambda w: -w[1])[:top]],
+                "cells":[{"weapon":list(w), "distance":x, "task":task, "seconds":s} for (w, x, task), s in cells]}
+
+    def save(self, filename, top=20):
+        with open(filename, 'w') as f: json.dump(self.summary(top), f, indent=1)
+
+def enable(): # Starts a new Report, and returns it
+    global active
+    active = Report()
+    return active
+
+def disable(): # Stops collecting, and returns what was collected
+    global active
+    report, active = active, None
+    return report
+
+def collect(function, *args): # function(*args), and the Report of just that call (for worker processes, where the caller can't see it)
+    enable()
+    try: return function(*args), active
+    finally: disable()
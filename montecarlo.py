@@ -0,0 +1,121 @@
+import numpy as np
+from statistics import NormalDist
+from simulate import *
+from simulate import _clip
+
+# Monte Carlo versions of one_burst and one_mag: instead of following every branch, simulate many engagements at once (as NumPy arrays)
+# with the same rules, and count the outcomes. The error shrinks with the square root of the number of samples, so this trades accuracy
+# for speed where the exact functions get too slow (long bursts, large magazines), and reports how far off the estimates may be.
+
+class SampledEvent(Event): # The outcomes of simulated engagements as a regular Event, plus confidence intervals for the usual estimates
+    def __init__(self, times, damages, shots, samples, confidence=0.95):
+        times, damages = np.asarray(times, dtype=np.int64), np.asarray(damages, dtype=np.int64)
+        outcomes = {}
+        if len(times):
+            keys, counts = np.unique(np.stack([times,damages],axis=1), axis=0, return_counts=True)
+            outcomes = {(t,d):c/samples for (t,d),c in zip(keys.tolist(), counts.tolist())}
+        Event.__init__(self, outcomes)
+        self.times, self.damages, self.shots, self.samples = times, damages, np.asarray(shots), samples
+        self.confidence = confidence
+
+    def _z(self):
+        return NormalDist().inv_cdf(0.5+self.confidence/2)
+
+    def kill_chance_ci(self, hp=100): # (estimate, low, high), as a Wilson score interval
+        n, z = self.samples, self._z()
+        p = np.count_nonzero(self.damages>=hp)/n
+        center = (p+z*z/(2*n))/(1+z*z/n)
+        spread = z*sqrt(p*(1-p)/n+z*z/(4*n*n))/(1+z*z/n)
+        return self.kill_chance(hp), float(max(center-spread,0)), float(min(center+spread,1))
+
+    def kill_time_ci(self, pmin=0.5, hp=100): # (estimate, low, high), from the order statistics of the time to kill (inf if there was no kill)
+        n, z = self.samples, self._z()
+        kills = np.sort(np.concatenate([np.where(self.damages>=hp, self.times, inf), np.full(n-len(self.times), inf)]))
+        spread = z*sqrt(n*pmin*(1-pmin))
+        lo, hi = int(min(max(floor(n*pmin-spread),0),n-1)), int(min(max(ceil(n*pmin+spread),0),n-1))
+        return self.kill_time(pmin, hp), float(kills[lo]), float(kills[hi])
+
+    def dps_ci(self): # (estimate, low, high), with the variance of the ratio of means from the delta method
+        if not len(self.times): return 0, 0, 0
+        t, d = self.times.astype(float), self.damages.astype(float)
+        if t.mean()<=0: return 0, 0, 0
+        r = d.mean()/t.mean()
+        spread = self._z()*sqrt(max(np.var(d-r*t), 0)/len(t))/t.mean()
+        return self.dps(), float(1000*(r-spread)), float(1000*(r+spread))
+
+class _Stats: # Everything the rules need at one distance; per-shot chances are arrays over the number of shots fired before
+    def __init__(self, gun, distance, max_hp, armor, cover):
+        f = np.arange(gun.ammo_capacity()+1)
+        acc = gun.accuracy(distance)+f*gun.followup_accuracy(distance)
+        self.capacity = gun.ammo_capacity()
+        self.can_fire = acc>0
+        ca = np.clip(acc*0.01, 0, 1)
+        if cover: ca = ca*0.5
+        cc = _clip(gun.crit_chance(distance)*.01)
+        blocked = armor[1]*0.01 if gun.penetration(distance)<armor[0] else 0
+        # One random number per pellet decides its outcome: crit, stopped by armor (1 damage), regular hit, or miss
+        self.crit, self.blocked, self.hit = ca*cc, ca*cc+ca*(1-cc)*blocked, ca
+        self.damage, self.max_hp, self.pellets = int(gun.damage(distance)), int(max_hp), gun.pellets()
+        self.burst = gun.burst(distance)
+        self.cycle = int(gun.cycle_time(distance))
+        self.gun, self.distance = gun, distance
+
+    def shot(self, rng, f): # Damage of one shot for each engagement, where f is the number of shots fired before
+        u = rng.random((len(f), max(self.pellets,1)))
+        dmg = np.where(u<self.crit[f,None], self.max_hp, np.where(u<self.blocked[f,None], 1, np.where(u<self.hit[f,None], self.damage, 0))).sum(axis=1)
+        if self.pellets>1: dmg = np.minimum(dmg, self.max_hp)
+        return dmg
+
+    def burst_(self, rng, s, ammo_used): # Same rules as one_burst; returns (fired, shots, time, damage) for engagements with s shots fired so far
+        left = self.capacity-s-ammo_used
+        bmin, bmax = self.burst
+        lo, hi = np.minimum(bmin, left), np.minimum(bmax, left)
+        fired = (left>=1) & (hi!=0) & ((hi<0) | (lo<=hi))
+        n, dmg = np.zeros(len(s), dtype=np.int64), np.zeros(len(s), dtype=np.int64)
+        if not fired.any(): return fired, n, n.copy(), dmg
+        if bmax<0: # Until the burst itself has done max_hp damage (it doesn't know about earlier ones), or the gun is empty
+            todo = fired.copy()
+            for i in range(int(left[fired].max())):
+                todo &= i<left
+                if not todo.any(): break
+                dmg[todo] += self.shot(rng, s[todo]+i)
+                n[todo] += 1
+                todo &= ~((i>=lo-1) & (dmg>=self.max_hp))
+        else:
+            n[fired] = rng.integers(lo[fired], hi[fired]+1)
+            for i in range(int(n.max())):
+                todo = i<n
+                dmg[todo] += self.shot(rng, s[todo]+i)
+        time = np.where(fired, int(self.gun.aim_time(self.distance)+self.gun.reset_time(self.distance))+n*self.cycle, 0)
+        return fired, n, time, np.minimum(dmg, self.max_hp)
+
+def sample_burst(gun, distance=10, followup=0, max_hp=100, armor=(0,0), cover=False, ammo_used=0, samples=10000, seed=None, confidence=0.95):
+    rng = np.random.default_rng(seed)
+    g = _Stats(gun, distance, max_hp, armor, cover)
+    fired, n, t, d = g.burst_(rng, np.full(samples, followup), ammo_used)
+    return SampledEvent(t[fired], d[fired], n[fired], samples, confidence)
+
+def sample_mag(gun, distance=10, ammo_used=0, max_hp=100, armor=(0,0), cover=False, timeout=10000, samples=10000, seed=None, confidence=0.95):
+    # Same rules as one_mag: reload when the mag is empty (even if the last burst was a kill), stop at a kill, or once timeout is reached
+    rng = np.random.default_rng(seed)
+    g = _Stats(gun, distance, max_hp, armor, cover)
+    s, t, d = np.zeros(samples, dtype=np.int64), np.zeros(samples, dtype=np.int64), np.zeros(samples, dtype=np.int64)
+    active = np.ones(samples, dtype=bool)
+    reload_time = None
+    while active.any():
+        empty = active & (s>=g.capacity-ammo_used)
+        if empty.any():
+            if reload_time is None: reload_time = int(gun.reload_empty_time())
+            t[empty] += reload_time
+        active &= ~empty & (d<g.max_hp)
+        active[active] = g.can_fire[s[active]]
+        idx = np.nonzero(active)[0]
+        if not len(idx): break
+        fired, n, bt, bd = g.burst_(rng, s[idx], ammo_used)
+        active[idx[~fired]] = False # Failed to fire
+        idx = idx[fired]
+        s[idx] += n[fired]
+        t[idx] += bt[fired]
+        d[idx] = np.minimum(d[idx]+bd[fired], g.max_hp)
+        if timeout: active[idx[t[idx]>=timeout]] = False
+    return SampledEvent(t, d, s, samples, confidence)
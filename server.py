@@ -0,0 +1,125 @@
+from stats import *
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import socket
+import json
+
+# Keeps the game data loaded, and answers questions about it as JSON (one request per line) on a local port or Unix socket, so a notebook or
+# another tool doesn't have to load the data and start with empty caches every time. Weapons and their stats are kept between requests, and
+# the simulations run in worker processes that keep their own (also loaded, also cached) copies, so a long one_mag doesn't hold up the rest.
+# Answers are kept too, and identical requests that arrive while one is still being calculated wait for that one instead of starting over.
+
+weapon_stats = ["accuracy", "crit_chance", "damage", "followup_accuracy", "penetration", "pellets", "burst", "ammo_capacity",
+                "aim_time", "reset_time", "cycle_time", "guard_time", "ready_time", "reload_time", "reload_empty_time"]
+simulations = {"shot":one_shot, "burst":one_burst, "mag":one_mag}
+summaries = {"expected_time":expected_time, "expected_damage":expected_damage, "kill_chance":kill_chance, "dps":dps,
+             "kill_time_50_percent":kill_time_50, "kill_time_95_percent":kill_time_95} # As in stats.py
+
+_data, _weapons = None, {} # In each process: the game data, and every Weapon built from it so far
+
+def _start_worker(datapath, cache, lazy): # See worker_pool, which also leaves Ctrl-C to the main process
+    global _data
+    if _data is None: _data = Data(datapath, cache, lazy=lazy) # Forked workers already have it
+
+def _weapon(weapon, ammo=None, scope=None, in_cover=False):
+    key = (weapon, ammo, scope, bool(in_cover))
+    if key not in _weapons:
+        w = Weapon(_data, weapon, ammo, scope, bool(in_cover))
+        if w.errors: raise ValueError(" ".join(w.errors))
+        _weapons[key] = w
+    return _weapons[key]
+
+def _described(weapon, values): # values, along with which weapon they're for (in case ammo or scope was left out) and why they might be nonsense
+    return dict(values, weapon=list(weapon.info()), warnings=weapon.warnings)
+
+# The requests, as {"query": name, ...parameters}; all but the simulations are answered in the main process, in a thread (see Server)
+def find_weapons(**filters): # Same parameters as match_weapons
+    return [list(w.info()) for w in match_weapons(_data, **filters)]
+
+def stats(weapon, ammo=None, scope=None, in_cover=False, distance=10):
+    w = _weapon(weapon, ammo, scope, in_cover)
+    return _described(w, {stat:getattr(w, stat)(distance) for stat in weapon_stats})
+
+def simulate(kind, weapon, ammo=None, scope=None, in_cover=False, distance=10, max_hp=100, armor=(0,0), cover=False): # kind is one of simulations
+    w = _weapon(weapon, ammo, scope, in_cover)
+    event = simulations[kind](w, distance, max_hp=max_hp, armor=tuple(armor), cover=cover)
+    return _described(w, {name:summary(event, max_hp) for name, summary in summaries.items()})
+
+class Server:
+    def __init__(self, executor, maxsize=4096):
+        self.executor = executor
+        self.thread = ThreadPoolExecutor(1) # For the other queries, so they don't hold up the event loop; only one, since they share the Weapons they build
+        self.answers = LRUCache(maxsize) # {request: Future}, finished or not
+        self.started = perf_counter()
+
+    def _start(self, query, parameters): # A Future for the answer
+        loop = asyncio.get_running_loop()
+        if query in simulations: return loop.run_in_executor(self.executor, partial(simulate, query, **parameters))
+        if query=="weapons": return loop.run_in_executor(self.thread, partial(find_weapons, **parameters))
+        if query=="stats": return loop.run_in_executor(self.thread, partial(stats, **parameters))
+        future = loop.create_future()
+        future.set_exception(ValueError("Unknown query '%s'"%query))
+        return future
+
+    async def answer(self, request):
+        parameters = dict(request)
+        query = parameters.pop("query", None)
+        parameters.pop("id", None)
+        if query=="status": return {"seconds":perf_counter()-self.started, "answers":self.answers.info(), "weapons":len(_weapons)}
+        key = json.dumps([query, parameters], sort_keys=True)
+        future = self.answers.get(key, self._start, query, parameters)
+        try: return await asyncio.shield(future) # A client that goes away doesn't cancel it for the others that wait for it
+        except Exception:
+            self.answers.discard(key) # Errors aren't kept, in case they had nothing to do with the request (e.g. a worker that died)
+            raise
+
+    async def _respond(self, line, writer):
+        request = None
+        try:
+            request = json.loads(line)
+            response = {"result":await self.answer(request)}
+        except Exception as e: response = {"error":"%s: %s"%(type(e).__name__, e)}
+        if isinstance(request, dict) and "id" in request: response["id"] = request["id"] # Answers can come out of order; the id tells which is which
+        writer.write((json.dumps(response)+"\n").encode())
+        await writer.drain()
+
+    async def handle(self, reader, writer): # One connection; every line is a request, and they are answered as soon as each is done
+        tasks = set()
+        try:
+            while line := await reader.readline():
+                task = asyncio.create_task(self._respond(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks: await asyncio.wait(tasks)
+        except ConnectionError: pass
+        finally: writer.close()
+
+async def serve(server, port=8765, path=None): # On localhost:port, or the Unix socket at path
+    if path: listener = await asyncio.start_unix_server(server.handle, path)
+    else: listener = await asyncio.start_server(server.handle, "127.0.0.1", port)
+    print("Listening on", path or "127.0.0.1:%d"%port)
+    async with listener: await listener.serve_forever()
+
+def ask(request, address=("127.0.0.1", 8765)): # Sends one request to a running server (a string address is a Unix socket), and returns the result
+    if isinstance(address, str):
+        connection = socket.socket(socket.AF_UNIX)
+        connection.connect(address)
+    else: connection = socket.create_connection(address)
+    with connection:
+        connection.sendall((json.dumps(request)+"\n").encode())
+        response = json.loads(connection.makefile().readline())
+    if "error" in response: raise RuntimeError(response["error"])
+    return response["result"]
+
+if __name__=="__main__":
+    parser = arguments("Keep the game data loaded, and answer questions about it as JSON (one request per line) on a local port.")
+    parser.add_argument("--port", type=int, default=8765, help="port on localhost to listen on")
+    parser.add_argument("--socket", help="listen on this Unix socket instead")
+    parser.add_argument("--workers", type=int, default=0, help="number of processes for the simulations (0: one per CPU core)")
+    args = parser.parse_args()
+    _data = load(args)
+    print(_data.cache_report())
+    executor, pids = worker_pool(args.workers or cpu_count(), _start_worker, (args.datapath, None if args.no_cache else args.cache, args.lazy))
+    try: asyncio.run(serve(Server(executor), args.port, args.socket))
+    except KeyboardInterrupt: pass
+    finally: stop_workers(executor, pids) # Without waiting for simulations in progress
@@ -1,5 +1,9 @@
 from weapon import *
 from math import *
+from heapq import heappush, heappop
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+import instrument
 
 # Some helper functions for dealing with probabilities and events
 
@@ -8,21 +12,92 @@ def _clip(v,p0=0,p1=1): return min(max(v,p0),p1)
 
 _eps = 1e-6 # Minimum probability to consider; one-in-a-million should be safe to ignore
 
+# Sorted views of an Event's outcomes, so that the queries (kill_time, kill_chance, expected) sort once and then only need a binary search
+# Each part is built the first time it's needed; kill times depend on hp, so there's one of those for every hp that was asked for
+class _View:
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self._expected, self._damage, self._kills = None, None, {}
+    
+    def expected(self): # (time, damage), normalized
+        if self._expected is None:
+            n, tt, td = 1/sum(self.outcomes.values()), 0, 0
+            for (t,d),p in self.outcomes.items():
+                tt+=t*(p*n)
+                td+=d*(p*n)
+            self._expected = tt, td
+        return self._expected
+    
+    def kill_chance(self, hp):
+        if self._damage is None: # Damage values in order, and the probability of each one or more
+            damage = {}
+            for (_,d),p in self.outcomes.items(): damage[d] = damage.get(d,0)+p
+            ds = sorted(damage)
+            self._damage = ds, list(accumulate([damage[d] for d in reversed(ds)]))[::-1]+[0]
+        ds, at_least = self._damage
+        return at_least[bisect_left(ds, hp)]
+    
+    def kills(self, hp): # Times of the kills in order, with the probability of a kill by then, and the same for the survivors, by time per damage
+        if hp not in self._kills:
+            kills, survivors = {}, []
+            for (t,d),p in self.outcomes.items():
+                if d>=hp: kills[t] = kills.get(t,0)+p
+                else: survivors.append((t/d if d>0 else inf, p))
+            times = sorted(kills)
+            by_time = list(accumulate(kills[t] for t in times))
+            survivors.sort(key=lambda x: x[0])
+            killed = by_time[-1] if by_time else 0
+            by_ratio = list(accumulate([p for _,p in survivors], initial=killed))[1:]
+            ratios = [r for r,_ in survivors if r<inf] # Survivors without damage come last, and never give a kill time
+            self._kills[hp] = times, by_time, ratios, by_ratio
+        return self._kills[hp]
+
+def _quantile(values, start, pmin, strict): # The first value (in order) at which start plus the probabilities so far reaches pmin (passes it, if strict), like
+    # Event.kill_times does for kills (by time) and survivors (by time per damage); None if they never get there
+    total = start
+    for v,p in sorted(values):
+        total += p
+        if total>pmin or (total>=pmin and not strict): return v
+    return None
+
+def _count_product(a, b, prod): # For instrument: how much work Event.__mul__ does, and how large the events get
+    report = instrument.active
+    report.count("Event.__mul__")
+    report.count("Event.__mul__ left outcomes", len(a.outcomes))
+    report.count("Event.__mul__ right outcomes", len(b.outcomes))
+    report.count("Event.__mul__ pairs", len(a.outcomes)*len(b.outcomes))
+    report.peak("Event outcomes", len(prod.outcomes))
+
 # The basic structure that represents possible outcomes as a map of {(time,damage):probability}
 # It's basically a probability tree that gets collapsed immediately
 class Event:
+    eps = _eps # Branches less likely than this are dropped by one_burst and one_mag
+    # How far off the outcomes may be: the total probability of the dropped branches, and the rounding of times and damage (see ApproxEvent)
+    pruned, time_error, damage_error = 0, 0, 0
+    _view = None # See _View; the methods that change outcomes reset it, so change them through these
+    
     def __init__(self, t=None, d=0, p=1):
         if isinstance(t,dict): self.outcomes=t
         elif t is not None: self.outcomes = {(int(t),int(d)):_clip(float(p))}
         else: self.outcomes={}
     
+    def _empty(self, pruned=0, time_error=None, damage_error=None): # New event of the same kind, for the results of the methods below
+        ev = Event()
+        if pruned or time_error or damage_error or self.time_error or self.damage_error: # Usually none of them, and the class has zeros
+            ev.pruned = pruned
+            ev.time_error = self.time_error if time_error is None else time_error
+            ev.damage_error = self.damage_error if damage_error is None else damage_error
+        return ev
+    
     def add_outcome(self, time, damage, p):
+        self._view = None
         key = (int(time),int(damage))
         if key in self.outcomes: self.outcomes[key]+=p
         else: self.outcomes[key]=p
     
     def __add__(self, other):
-        out = Event(self.outcomes.copy())
+        out = self._empty(self.pruned+other.pruned, max(self.time_error,other.time_error), max(self.damage_error,other.damage_error))
+        out.outcomes = self.outcomes.copy()
         for k,p in other.outcomes.items():
             if k in out.outcomes:
                 out.outcomes[k]+=p
@@ -30,17 +105,22 @@ class Event:
         return out
         
     def __rmul__(self, p): # Probabilites can be multiplied from the left, and float has no overload to multiply with Event 
-        prod = Event()
+        prod = self._empty(self.pruned*p)
         prod.outcomes = {k:v*p for k,v in self.outcomes.items()}
         return prod
     
     def __mul__(self, other):
         if not isinstance(other, Event):
             return other*self # Make sure it's not a float; in that case, use __rmul__
-        prod = Event()
+        pruned = 0
+        if self.pruned or other.pruned: # What the product of the complete events would have, minus what it has
+            ts, to = self.total(), other.total()
+            pruned = ts*other.pruned+self.pruned*to+self.pruned*other.pruned
+        prod = self._empty(pruned, self.time_error+other.time_error, self.damage_error+other.damage_error)
         for (st,sd),sp in self.outcomes.items():
             for (ot,od),op in other.outcomes.items():
                 prod.add_outcome(st+ot,sd+od,sp*op)
+        if instrument.active is not None: _count_product(self, other, prod)
         return prod
     
     def __repr__(self):
@@ -63,6 +143,7 @@ class Event:
         return sum(self.outcomes.values())
     
     def normalize(self):
+        self._view = None
         n = 1/self.total()
         for key in self.outcomes:
             self.outcomes[key]*=n
@@ -71,33 +152,34 @@ class Event:
         n = 1/self.total()
         return n*self
     
+    def _distributions(self):
+        if self._view is None: self._view = _View(self.outcomes)
+        return self._view
+    
     def expected(self):
         if not self.outcomes: return inf, 0
-        tt, td, tp = 0, 0, 0
-        for (t,d),p in self.normalized().outcomes.items():
-            tt+=t*p
-            td+=d*p
-            tp+=p
-        return tt,td
+        return self._distributions().expected()
     
     def capped(self, max_hp=100):
-        ev2 = Event()
+        ev2 = self._empty(self.pruned)
         for (t,d),p in self.outcomes.items():
             ev2.add_outcome(t,min(d,max_hp),p)
         return ev2
         
     def cap(self, max_hp=100):
-        self.outcomes = self.capped(max_hp).outcomes
+        ev2 = self.capped(max_hp)
+        self.outcomes, self.damage_error, self._view = ev2.outcomes, ev2.damage_error, None
     
+    # The pruned probability can't be split, so it stays with the first part (the one that usually continues in one_mag)
     def split_by_damage(self, damage=100):
-        alive, dead = Event(), Event()
+        alive, dead = self._empty(self.pruned), self._empty()
         for (t,d),p in self.outcomes.items():
             if d<damage: alive.add_outcome(t,d,p)
             else: dead.add_outcome(t,d,p)
         return alive, dead
 
     def split_by_time(self, timeout=10000):
-        before, after = Event(), Event()
+        before, after = self._empty(self.pruned), self._empty()
         for (t,d),p in self.outcomes.items():
             if t<timeout: before.add_outcome(t,d,p)
             else: after.add_outcome(t,d,p)
@@ -109,25 +191,119 @@ class Event:
         else: return 1000*d/t
     
     def kill_chance(self, hp=100):
-        return self.split_by_damage(hp)[1].total()
+        return self._distributions().kill_chance(hp)
     
     def kill_time(self, pmin=0.5, hp=100):
-        tp, tmax = 0, 0
-        a,d = self.split_by_damage(hp)
-        for (t,_),p in d.outcomes.items():
-            tp += p
-            if tp>=pmin: return t
-        for (t,dmg),p in sorted(a.outcomes.items(),key=lambda x: x[0][0]/x[0][1] if x[0][1]>0 else inf):
-            tp += p
-            if dmg>0:
-                tmax=max(tmax, t/dmg*hp)
-                if tp>pmin: return t/dmg*hp
-        if tp>0: return tmax/tp*pmin
-        else: return inf
+        return self.kill_times([pmin], hp)[0]
+    
+    def kill_times(self, pmins=(0.5,), hp=100): # kill_time for each of pmins, from one pass over the outcomes
+        times, by_time, ratios, by_ratio = self._distributions().kills(hp)
+        out = []
+        for pmin in pmins:
+            i = bisect_left(by_time, pmin)
+            if i<len(times): out.append(times[i]); continue
+            # Not enough kills: guess from the survivors, as if their damage went on at the same rate until they're dead
+            i = bisect_right(by_ratio, pmin, 0, len(ratios))
+            if i<len(ratios): out.append(ratios[i]*hp); continue
+            tp, tmax = (by_ratio[-1] if by_ratio else by_time[-1] if by_time else 0), (ratios[-1]*hp if ratios else 0)
+            out.append(tmax/tp*pmin if tp>0 else inf)
+        return out
+    
+    # Ranges (low, high) that the exact results lie in, given the pruned probability and rounding errors (just the result itself if there are none)
+    # Rounded damage is never too high (by up to damage_error), rounded times may be too high or low (by up to time_error)
+    def kill_chance_bounds(self, hp=100): # The pruned outcomes may all have been kills
+        return self.kill_chance(hp), min(self.kill_chance(hp-self.damage_error)+self.pruned, 1)
+    
+    def kill_time_bounds(self, pmin=0.5, hp=100):
+        # kill_time either comes from the kills, or (if there aren't enough) from the survivors' time per damage, and the errors can move the exact
+        # result to either side of that line; so both are bounded, each from the outcomes moved as far as the errors allow in one direction
+        # (earlier, more damage and the pruned ones as kills at 0 for low; later and the rounded damage for high), and each that's possible counts.
+        # Survivors are never killed in the exact fight either, so they always took the same shots
+        exact = self.kill_time(pmin, hp) # Also refuses where kill_time does
+        if not (self.pruned or self.time_error or self.damage_error): return exact, exact
+        te, de = self.time_error, self.damage_error
+        early, late, low_ratios, high_ratios = [(0, self.pruned)], [], [], [] # Kills (time, p), and survivors (time per damage, p)
+        latest = 0 # Of the outcomes that may be kills
+        for (t,d),p in self.outcomes.items():
+            if d>=hp: late.append((t+te, p))
+            if d+de>=hp: early.append((max(t-te,0) if not de else 0, p)); latest = max(latest, t+te) # Unless the damage is exact, a fight may have gone
+            # on past the kill (one_burst and one_mag stop at the kills they see), so that kill may have come at any time before this one
+            elif d>0: low_ratios.append((max(t-te,0)/(d+de), p)) # Rounding never takes damage down to 0, so no damage is exact
+            if 0<d<hp: high_ratios.append(((t+te)/d, p))
+        most, least = sum(p for _,p in early), sum(p for _,p in late) # Chances of a kill
+        lows, highs = [], []
+        if most>=pmin: # The exact kill time may come from the kills
+            lows.append(_quantile(early, 0, pmin, False))
+            highs.append(_quantile(late, 0, pmin, False) if least>=pmin else latest if not self.pruned else inf)
+        if least<pmin: # Or from the survivors; if they don't get there either, kill_times guesses from the total, which isn't bounded here
+            low, high = _quantile(low_ratios, most, pmin, True), _quantile(high_ratios, least, pmin, True)
+            lows.append(low*hp if low is not None else 0)
+            highs.append(high*hp if high is not None else inf)
+        return max(min(lows), 0), max(highs)
+    
+    def dps_bounds(self): # The pruned outcomes may have had anything from no damage at time 0 to the most damage at the latest time in this event
+        if not self.outcomes: return 0, inf
+        t, d = self.expected()
+        w = self.total()/(self.total()+self.pruned)
+        tmax, dmax = max(t for t,_ in self.outcomes), max(d for _,d in self.outcomes)
+        tlow, thigh = w*max(t-self.time_error,0), w*(t+self.time_error)+(1-w)*tmax
+        dlow, dhigh = w*d, w*(d+self.damage_error)+(1-w)*dmax
+        return (1000*dlow/thigh if thigh>0 else 0), (1000*dhigh/tlow if tlow>0 else inf)
+    
+# Approximation mode: pass an Approximation as the backend to one_shot/one_burst/one_mag, and its ApproxEvents will round all times
+# to multiples of time_step, and damage (below max_hp) down to steps of damage_step, and drop branches below eps. Coarser steps mean
+# fewer different outcomes (and less work), with the errors kept in time_error, damage_error and pruned, and reported by the *_bounds methods
+# (except for fights that the rounding moves to the other side of one_mag's timeout; pass timeout=0 if that matters)
+class Approximation:
+    def __init__(self, time_step=1, damage_step=1, eps=_eps):
+        self.time_step, self.damage_step, self.eps = time_step, damage_step, eps
+    
+    def __call__(self, t=None, d=0, p=1):
+        return ApproxEvent(t, d, p, self)
+    
+    def _settings(self):
+        return (self.time_step, self.damage_step, self.eps)
+    
+    def __eq__(self, other): # So that memoized results are shared between equal settings
+        return isinstance(other, Approximation) and self._settings()==other._settings()
+    
+    def __hash__(self):
+        return hash(self._settings())
+    
+    def __repr__(self):
+        return "Approximation(time_step=%r, damage_step=%r, eps=%r)"%self._settings()
+
+class ApproxEvent(Event):
+    def __init__(self, t=None, d=0, p=1, approximation=Approximation()):
+        self.approximation = approximation
+        if t is not None and not isinstance(t,dict): # Everything is built from these, so if their times are on the grid, all sums are too
+            step = approximation.time_step
+            t, t0 = int(round(int(t)/step)*step), t
+            self.time_error = abs(t-int(t0))
+        Event.__init__(self, t, d, p)
+    
+    def _empty(self, pruned=0, time_error=None, damage_error=None):
+        ev = ApproxEvent(approximation=self.approximation)
+        ev.pruned = pruned
+        ev.time_error = self.time_error if time_error is None else time_error
+        ev.damage_error = self.damage_error if damage_error is None else damage_error
+        return ev
+    
+    def capped(self, max_hp=100): # Also rounds damage below max_hp down to the steps (so it never turns a kill into a non-kill or back)
+        step, moved = self.approximation.damage_step, 0
+        ev2 = self._empty(self.pruned)
+        for (t,d),p in self.outcomes.items():
+            if d>=max_hp: d2 = max_hp
+            elif d<step: d2 = d # Never down to 0, which would turn a hit into a miss
+            else: d2, moved = d//step*step, max(moved, d%step)
+            ev2.add_outcome(t,d2,p)
+        ev2.damage_error = self.damage_error+moved
+        return ev2
     
 # Armor is (piercing, coverage%); Assumption: Crits ignore armor
-def one_pellet(gun, distance=10, followup=0, max_hp=100, armor=(0,0), cover=False):
-    event = Event()
+# backend is the Event class used for the outcomes; everything downstream follows the pellet's type (see dense.py)
+def one_pellet(gun, distance=10, followup=0, max_hp=100, armor=(0,0), cover=False, backend=Event):
+    event = backend()
     ca = _clip((gun.accuracy(distance)+followup*gun.followup_accuracy(distance))*0.01)
     if cover: ca*=0.5 # Not sure if this is true, but feels about right
     cc = _clip(gun.crit_chance(distance)*.01)
@@ -141,23 +317,33 @@ def one_pellet(gun, distance=10, followup=0, max_hp=100, armor=(0,0), cover=Fals
     if ca<1: event.add_outcome(0,0,1-ca)
     return event
 
-def one_shot(gun, distance=10, followup=0, max_hp=100, armor=(0,0), cover=False):
-    p1 = one_pellet(gun, distance, followup, max_hp, armor, cover)
+# one_shot and one_burst remember their most recent results (see memoize in weapon.py), since the same ones are needed again and again:
+# every burst is made of shots with the same followup numbers, and one_mag and all the tables of a weapon need the same bursts
+@memoize(4096)
+def one_shot(gun, distance=10, followup=0, max_hp=100, armor=(0,0), cover=False, backend=Event):
+    p1 = one_pellet(gun, distance, followup, max_hp, armor, cover, backend)
     np = gun.pellets()
-    if np<=1: return p1*Event(gun.cycle_time(distance))
-    else:
-        shot = Event(0)
-        for p in range(np):
-            shot=shot*p1
-    return shot.capped(max_hp)*Event(gun.cycle_time(distance))
+    if np<=1: return p1*backend(gun.cycle_time(distance))
+    return _repeat(p1, np, max_hp)*backend(gun.cycle_time(distance))
+
+# All pellets of a shot at once, by repeated squaring; capping after every step gives the same result as capping at the end,
+# but keeps the number of outcomes down to max_hp+1 (the DenseEvent backend switches to FFT convolution for large ones)
+def _repeat(event, n, max_hp=100):
+    result, square = None, event.capped(max_hp)
+    while n:
+        if n&1: result = square if result is None else (result*square).capped(max_hp)
+        n >>= 1
+        if n: square = (square*square).capped(max_hp)
+    return result
 
 # expects a list [(shots,event)], returns a single event
-def collapse(events):
-    collapsed = Event()
+def collapse(events, backend=Event):
+    collapsed = backend()
     for _,ev in events: collapsed = collapsed + ev
     return collapsed
 
-def one_burst(gun, distance=10, followup=0, max_hp=100, armor=(0,0), cover=False, ammo_used=0, collapsed=True):
+@memoize(256)
+def one_burst(gun, distance=10, followup=0, max_hp=100, armor=(0,0), cover=False, ammo_used=0, collapsed=True, backend=Event):
     # The doc isn't 100% clear on this, but my assumption is that the timing for, e.g. a 3-Round-Burst works like this:
     # Wait for aimTime, fire one shot, wait for 1/rps, fire one shot, wait for 1/rps, fire one shot, wait for 1/rps (???), wait for resetTime
     # I also assume followupAccuracy carries over between shot sequences, since the parameter is non-zero for some one-shot "sequences"
@@ -166,55 +352,204 @@ def one_burst(gun, distance=10, followup=0, max_hp=100, armor=(0,0), cover=False
     bmin, bmax = gun.burst(distance)
     bmin = min(bmin, shots_left)
     bmax = min(bmax, shots_left)
-    out = []
+    out, pruned = [], 0
     if shots_left<1: pass # Gun empty, nothing happens
     elif bmax==0: pass # Target out of range, nothing happens
     elif bmax<0: # =-1: will shoot until enemy is dead or gun is empty (i.e. may end early)
-        sequence = Event(gun.aim_time(distance)+gun.reset_time(distance))
+        sequence = backend(gun.aim_time(distance)+gun.reset_time(distance))
         for i in range(shots_left):
-            sequence = sequence*one_shot(gun,distance,followup+i,max_hp,armor,cover)
+            sequence = sequence*one_shot(gun,distance,followup+i,max_hp,armor,cover,backend)
             if i>=bmin-1:
                 alive, dead = sequence.split_by_damage(max_hp)
-                if alive.total()<_eps: break
-                if dead.total()>_eps: out+=[(i+1,dead.capped(max_hp))]
+                if alive.total()<backend.eps: # Too unlikely to follow any further, so what it would still do is unknown: pruned
+                    pruned += alive.total()+alive.pruned
+                    sequence = dead
+                    break
+                if dead.total()>backend.eps: out+=[(i+1,dead.capped(max_hp))]
+                else: pruned += dead.total()
                 sequence = alive
         out+=[(i+1,sequence.capped(max_hp))]
     else: # >0: the full number of rounds will always be fired
         p = 1/(1+bmax-bmin)
-        for n in range(bmin, bmax+1):
-            sequence = Event(gun.aim_time(distance)+gun.reset_time(distance))
-            for i in range(n):
-                sequence=sequence*one_shot(gun,distance,followup+i,max_hp,armor,cover)
-            out+=[(n,p*sequence.capped(max_hp))]
-    if collapsed: return collapse(out)
+        sequence = backend(gun.aim_time(distance)+gun.reset_time(distance))
+        for n in range(bmax+1): # Each burst length continues the sequence of the shorter ones
+            if n>0: sequence=(sequence*one_shot(gun,distance,followup+n-1,max_hp,armor,cover,backend)).capped(max_hp) # Capping early gives the same result, with fewer outcomes
+            if n>=bmin: out+=[(n,p*sequence)]
+    if out and pruned: out[-1][1].pruned += pruned
+    if instrument.active is not None: instrument.active.count("pruned by one_burst", pruned)
+    if collapsed: return collapse(out, backend)
     else: return out
 
-def one_mag(gun, distance=10, ammo_used=0, max_hp=100, armor=(0,0), cover=False, timeout=10000, collapsed=True):
+def one_mag(gun, distance=10, ammo_used=0, max_hp=100, armor=(0,0), cover=False, timeout=10000, collapsed=True, backend=Event):
     # Will keep firing until either the mag is empty (and add reload time), the enemy is dead (and not add reload time), or timeout is reached (otherwise, MGs can take very, very long to resolve)
-    current_events = [(0,Event(0))]
+    # Pending states are merged by the number of shots fired, and the burst that follows each one only depends on that number
+    # Branches that are dropped for being too unlikely (below backend.eps) are added up in pruned, which the result gets at the end
+    current_events = {0:backend(0)}
     resolved_events = []
+    bursts = {}
+    pruned = 0
     while current_events:
-        new_events=[]
-        for s,ev in current_events:
+        new_events={}
+        for s,ev in current_events.items():
             if s>=gun.ammo_capacity()-ammo_used:
-                resolved_events+=[(s,ev*Event(gun.reload_empty_time()))]
+                resolved_events+=[(s,ev*backend(gun.reload_empty_time()))]
                 continue
             a,d = ev.split_by_damage(max_hp)
-            if d.total()>_eps: resolved_events+=[(s,d)]
-            if a.total()>_eps:
+            if d.total()>backend.eps: resolved_events+=[(s,d)]
+            else: pruned += d.total()+d.pruned
+            if a.total()<=backend.eps: pruned += a.total()+a.pruned
+            else:
                 if gun.accuracy(distance)+s*gun.followup_accuracy(distance)>0:
-                    burst = one_burst(gun, distance, s, max_hp, armor, cover, ammo_used, False)
-                    for s2, e2 in burst:
-                        new_events+=[(s+s2,(a*e2).capped(max_hp))]
-                    if not burst: # Failed to fire
+                    if s not in bursts:
+                        bursts[s] = one_burst(gun, distance, s, max_hp, armor, cover, ammo_used, False, backend)
+                        if instrument.active is not None: instrument.active.count("one_mag bursts")
+                    for s2, e2 in bursts[s]:
+                        e2 = (a*e2).capped(max_hp)
+                        new_events[s+s2] = new_events[s+s2]+e2 if s+s2 in new_events else e2
+                    if not bursts[s]: # Failed to fire
                         resolved_events+=[(s,a)]
                 else: resolved_events+=[(s,a)]
         if timeout:
-            current_events = []
-            for s,e in new_events:
+            current_events = {}
+            for s,e in new_events.items():
                 b,a = e.split_by_time(timeout)
-                if b.total()>_eps: current_events+=[(s,b)]
-                if a.total()>_eps: resolved_events+=[(s,a)]
+                if b.total()>backend.eps: current_events[s]=b
+                else: pruned += b.total()+b.pruned
+                if a.total()>backend.eps: resolved_events+=[(s,a)]
+                else: pruned += a.total()+a.pruned
         else: current_events = new_events
-    if collapsed: return collapse(resolved_events)
+    if resolved_events and pruned: resolved_events[-1][1].pruned += pruned
+    if instrument.active is not None:
+        instrument.active.count("one_mag")
+        instrument.active.count("pruned by one_mag", pruned)
+    if collapsed: return collapse(resolved_events, backend)
     else: return resolved_events
+
+def stream_mag(gun, distance=10, ammo_used=0, max_hp=100, armor=(0,0), cover=False, timeout=10000, eps=_eps):
+    # Same fight as one_mag, but yields the resolved outcomes one by one as (time, damage, probability), in order of time, so whoever only
+    # needs the early part of the fight can stop there. Pending states (time, shots, damage) are taken from a heap, earliest first: a burst
+    # never takes negative time, so everything that merges into a state has arrived by then, and nothing resolved later can come before it
+    # Like in one_mag, states less likely than eps are dropped instead of followed, so the heap can't grow without bounds; the total probability
+    # of what was dropped is the generator's return value (and counted by instrument), so the probabilities read add up to 1 minus that
+    capacity = gun.ammo_capacity()-ammo_used
+    pending, heap = {(0,0,0,False):1.0}, [(0,0,0,False)] # The last entry marks outcomes that are resolved, but only after a reload
+    bursts = {}
+    pruned = 0
+    def add(key, p):
+        if key in pending: pending[key]+=p
+        else:
+            pending[key] = p
+            heappush(heap, key)
+    try:
+        while heap:
+            key = heappop(heap)
+            p = pending.pop(key)
+            if p<eps:
+                pruned += p
+                continue
+            t, s, d, reloaded = key
+            if reloaded or (timeout and s>0 and t>=timeout): yield t, d, p
+            elif s>=capacity: add((t+int(gun.reload_empty_time()),s,d,True), p)
+            elif d>=max_hp: yield t, d, p
+            elif gun.accuracy(distance)+s*gun.followup_accuracy(distance)>0:
+                if s not in bursts: bursts[s] = one_burst(gun, distance, s, max_hp, armor, cover, ammo_used, False)
+                for s2, e2 in bursts[s]:
+                    for (t2,d2),p2 in e2.outcomes.items():
+                        add((t+t2,s+s2,min(d+d2,max_hp),False), p*p2)
+                if not bursts[s]: yield t, d, p # Failed to fire
+            else: yield t, d, p
+        return pruned
+    finally: # Also when it's stopped early
+        if instrument.active is not None: instrument.active.count("pruned by stream_mag", pruned)
+
+def mag_kill_time(gun, distance=10, pmin=0.5, ammo_used=0, max_hp=100, armor=(0,0), cover=False, timeout=10000):
+    # Time until the target is dead with a chance of pmin, running the fight only until then
+    # If it never gets there, the rest of the fight is needed anyway, and Event.kill_time estimates it from the survivors
+    tp, rest = 0, Event()
+    for t,d,p in stream_mag(gun, distance, ammo_used, max_hp, armor, cover, timeout):
+        if d>=max_hp:
+            tp += p
+            if tp>=pmin: return t
+        rest.add_outcome(t,d,p)
+    return rest.kill_time(pmin, max_hp)
+
+def mag_kill_chance(gun, distance=10, time_limit=inf, ammo_used=0, max_hp=100, armor=(0,0), cover=False, timeout=10000):
+    # Chance that the target is dead within time_limit (in ms), running the fight only until then
+    kc = 0
+    for t,d,p in stream_mag(gun, distance, ammo_used, max_hp, armor, cover, timeout):
+        if t>time_limit: break
+        if d>=max_hp: kc += p
+    return kc
+
+def markov_mag(gun, distance=10, ammo_used=0, max_hp=100, armor=(0,0), cover=False, timeout=10000, collapsed=True):
+    # Same fight as one_mag, as an absorbing Markov chain: the states are (shots fired, damage), and the absorbing ones are kill, empty mag and timeout
+    # Instead of a full time distribution, each state only carries its probability and the first two moments of its time, so the cost grows with
+    # mag size and max_hp, not with the number of different timings. Expected damage and time (and so dps and kill_chance) match one_mag as long as
+    # the timeout doesn't cut the fight short (it applies to each state's mean time), but there are no kill times (see MomentEvent)
+    capacity = gun.ammo_capacity()-ammo_used
+    states = {0:{0:(1.0,0.0,0.0)}} # {shots:{damage:(p, p*E[t], p*E[t^2])}}
+    resolved = {}
+    def resolve(s, d, p, pt, pt2):
+        rp, rpt, rpt2 = resolved.setdefault(s,{}).get(d,(0,0,0))
+        resolved[s][d] = (rp+p, rpt+pt, rpt2+pt2)
+    while states:
+        s = min(states) # Shots never go down, so everything that can reach these states has already arrived
+        current = states.pop(s)
+        if s>0 and timeout:
+            for d,(p,pt,pt2) in list(current.items()):
+                if pt>=timeout*p:
+                    resolve(s, d, p, pt, pt2)
+                    del current[d]
+        if s>=capacity:
+            rt = int(gun.reload_empty_time())
+            for d,(p,pt,pt2) in current.items(): resolve(s, d, p, pt+p*rt, pt2+2*pt*rt+p*rt*rt)
+            continue
+        alive = {d:v for d,v in current.items() if d<max_hp}
+        dead = {d:v for d,v in current.items() if d>=max_hp}
+        if sum(v[0] for v in dead.values())>_eps:
+            for d,v in dead.items(): resolve(s, d, *v)
+        if sum(v[0] for v in alive.values())<=_eps: continue
+        kernel = {}
+        if gun.accuracy(distance)+s*gun.followup_accuracy(distance)>0:
+            for n, ev in one_burst(gun, distance, s, max_hp, armor, cover, ammo_used, False):
+                for (t,dd),p in ev.outcomes.items(): # Only the probability and time moments of each (shots, damage) step matter
+                    kp, kpt, kpt2 = kernel.get((n,dd),(0,0,0))
+                    kernel[n,dd] = (kp+p, kpt+p*t, kpt2+p*t*t)
+        if not kernel: # Failed to fire
+            for d,v in alive.items(): resolve(s, d, *v)
+            continue
+        q, lt, lt2 = kernel.pop((0,0),(0,0,0)) # A burst of 0 shots that does no damage leads straight back to the same state
+        if q>=1:
+            for d,v in alive.items(): resolve(s, d, *v)
+            continue
+        r = 1/(1-q) # Repeats are geometric; these are the sums over any number of them
+        for d,(p,pt,pt2) in alive.items():
+            p, pt, pt2 = p*r, pt*r+p*lt*r*r, pt2*r+2*pt*lt*r*r+p*(lt2*r*r+2*lt*lt*r*r*r)
+            for (n,dd),(kp,kpt,kpt2) in kernel.items():
+                s2, d2 = s+n, min(d+dd, max_hp)
+                sp, spt, spt2 = states.setdefault(s2,{}).get(d2,(0,0,0))
+                states[s2][d2] = (sp+p*kp, spt+pt*kp+p*kpt, spt2+pt2*kp+2*pt*kpt+p*kpt2)
+    out = []
+    for s in sorted(resolved):
+        ev = MomentEvent()
+        for d,(p,pt,pt2) in resolved[s].items():
+            if p<=0: continue
+            t, sd = pt/p, sqrt(max(pt2/p-(pt/p)**2, 0))
+            sd = min(sd, t) # Keep both points at t>=0; this only ever narrows the spread
+            ev.add_outcome(round(t-sd), d, p/2)
+            ev.add_outcome(round(t+sd), d, p/2)
+        out += [(s,ev)]
+    if collapsed: return collapse(out, MomentEvent)
+    else: return out
+
+class MomentEvent(Event): # What markov_mag returns: each state is put at two points in time with the right mean and variance, which is
+    # enough for expected, dps and kill_chance, but says little about when the kills happen, so kill_time (and everything based on it) refuses
+    def _empty(self, pruned=0, time_error=None, damage_error=None):
+        ev = MomentEvent()
+        ev.pruned = pruned
+        ev.time_error = self.time_error if time_error is None else time_error
+        ev.damage_error = self.damage_error if damage_error is None else damage_error
+        return ev
+    
+    def kill_times(self, pmins=(0.5,), hp=100):
+        raise ValueError("markov_mag only keeps the mean and spread of the times, not their distribution; use one_mag or stream_mag for kill times")
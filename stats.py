@@ -1,4 +1,17 @@
 from simulate import *
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os import cpu_count, getpid, kill, makedirs, replace
+from multiprocessing import SimpleQueue
+from hashlib import sha1
+from os.path import join
+from signal import signal, SIGINT, SIGTERM, SIG_IGN
+from time import perf_counter
+from inspect import signature
+from decimal import Decimal
+from numbers import Real
+from database import ResultDatabase, default_target
+import instrument
 
 all_sides = ["Player", "Enemy"]
 all_slots = ["Primary", "Secondary"]
@@ -32,6 +45,13 @@ def match_weapons(data, sides=None, slots=None, classes=None, weapons=None, ammo
                 else: weaponlist.append(Weapon(data,wname,aname,None,bool(in_cover)))
     return [weapon for weapon in weaponlist if weapon.valid]
 
+# Ways to simulate a full magazine: exact, as a Markov chain that is much faster for long fights but has no kill times (see markov_mag), or by sampling
+mag_engines = {"exact":one_mag, "markov":markov_mag}
+try: # Needs NumPy
+    from montecarlo import sample_mag
+    mag_engines["montecarlo"] = sample_mag
+except ImportError: pass
+
 def all_cutoffs(weapons):
     cuts = set()
     for w in weapons:
@@ -51,19 +71,445 @@ def x_axis(points, split_at=[], split_size=1e-3, max_steps_per_meter=10):
             axis+=[p/max_steps_per_meter]
     return sorted(axis)
 
-def make_table(weapons, distances, y_function, colsep=';', rowsep='\n'): # y_function is any function that takes a weapon and a distance and returns a number
-    table = colsep.join(["Weapon","Ammo","Scope","inCover"]+[str(x) for x in distances])+rowsep
+def _decimals(step): # Digits after the decimal point that multiples of step need (e.g. 1 for 0.1), so distances can be rounded to them
+    return max(0, -Decimal(repr(float(step))).normalize().as_tuple().exponent)
+
+def _parts(weapon, start, end, split_size, digits): # [(lo, hi)] of the weapon's curves between its cutoffs, split like in x_axis
+    cuts = [c for c in weapon.cutoffs() if start<c<end]
+    bounds = [round(float(x), digits) for x in [start]+[x for c in cuts for x in (c-split_size, c+split_size)]+[end]]
+    return list(zip(bounds[::2], bounds[1::2]))
+
+def _refine(weapon, values_at, start=0, end=100, tolerance=0.05, absolute=0, max_step=25, min_step=2.5, split_size=1e-3):
+    # {distance: values_at(distance)} at the distances one weapon's curves need (see adaptive_axis), where values_at returns a list with a value for each curve
+    digits = max(_decimals(min_step), _decimals(split_size))
+    found = {}
+    def at(x):
+        if x not in found: found[x] = values_at(x)
+        return found[x]
+    parts = _parts(weapon, start, end, split_size, digits)
+    for lo, hi in parts:
+        for x in [lo, hi]+[round(float(j*max_step), digits) for j in range(int(lo//max_step)+1, int(ceil(hi/max_step)))]: at(x)
+    n = len(next(iter(found.values())))
+    scale = [max([abs(v[k]) for v in found.values() if abs(v[k])<inf], default=0) for k in range(n)]
+    for lo, hi in parts:
+        xs = sorted(x for x in found if lo<=x<=hi)
+        todo = list(zip(xs, xs[1:]))
+        while todo:
+            a, b = todo.pop()
+            m = round(float(round((a+b)/2/min_step)*min_step), digits)
+            if not a+min_step/2<m<b-min_step/2: continue
+            ya, ym, yb = at(a), at(m), at(b)
+            for k in range(n):
+                if inf in (abs(ya[k]), abs(ym[k]), abs(yb[k])): off = not ya[k]==ym[k]==yb[k]
+                else: off = abs(ym[k]-ya[k]-(yb[k]-ya[k])*(m-a)/(b-a))>max(absolute, tolerance*scale[k])
+                if off:
+                    todo += [(a,m), (m,b)]
+                    break
+    return found
+
+def _between(x, a, b, ya, yb): # The value at x on the line from (a, ya) to (b, yb), or the nearer one if either is infinite
+    if inf in (abs(ya), abs(yb)): return ya if x-a<=b-x else yb
+    return ya+(yb-ya)*(x-a)/(b-a)
+
+def _combine(weapons, found, values_at, start=0, end=100, split_size=1e-3, min_step=2.5, **options):
+    # The axis of all distances in found (one {distance: values} for each weapon, from _refine), with every weapon's values at all of them:
+    # taken from the straight line between its nearest own distances, or the nearer one if that's infinite (like database.py does);
+    # values_at(i, x) is only needed for distances that fall right at a cutoff of weapon i
+    digits = max(_decimals(min_step), _decimals(split_size))
+    axis = sorted(set(x for points in found for x in points))
+    for i, weapon in enumerate(weapons):
+        points = found[i]
+        for lo, hi in _parts(weapon, start, end, split_size, digits):
+            xs = sorted(x for x in points if lo<=x<=hi)
+            for x in axis:
+                if not lo<x<hi or x in points: continue
+                j = bisect_left(xs, x)
+                a, b = xs[j-1], xs[j]
+                points[x] = [_between(x, a, b, ya, yb) for ya, yb in zip(points[a], points[b])]
+        for x in axis:
+            if x not in points: points[x] = values_at(i, x)
+    return axis, found
+
+def adaptive_axis(weapons, y_functions, **options):
+    # Distances for a table of y_functions (one, or a list of them that share the axis), only where they're needed: each weapon's curve is split at
+    # its cutoffs like in x_axis and sampled every max_step meters, and then an interval is split in the middle wherever the curve is further from
+    # the straight line between its ends than tolerance times its largest value (or absolute), down to min_step (see _refine for the defaults)
+    # Returns (axis, values), where values[k][i][x] is y_functions[k](weapons[i], x); the axis has the distances of all curves, and where one
+    # wasn't calculated (because it's straight enough there), its value is taken from that line, so the table doesn't calculate anything else
+    if callable(y_functions): y_functions = [y_functions]
+    values_at = lambda i, x: [f(weapons[i], x) for f in y_functions]
+    found = [_refine(weapon, partial(values_at, i), **options) for i, weapon in enumerate(weapons)]
+    axis, found = _combine(weapons, found, values_at, **options)
+    return axis, [[{x:points[x][k] for x in axis} for points in found] for k in range(len(y_functions))]
+
+def make_adaptive_table(weapons, y_function, colsep=';', rowsep='\n', **options): # make_table at the distances from adaptive_axis (with these options), without calculating anything twice
+    axis, values = adaptive_axis(weapons, y_function, **options)
+    rows = [_header(axis, colsep)]+[colsep.join(_info(weapon)+[str(values[0][i][x]) for x in axis]) for i, weapon in enumerate(weapons)]
+    return "".join(row+rowsep for row in rows)
+
+def _header(distances, colsep):
+    return colsep.join(["Weapon","Ammo","Scope","inCover"]+[str(x) for x in distances])
+
+def _timed(weapon, x, task, function, *args): # function(*args), with the time it took added to instrument's report (x is None for all distances at once)
+    t0 = perf_counter()
+    value = function(*args)
+    instrument.active.time(weapon, x, task, perf_counter()-t0)
+    return value
+
+def _row(weapon, distances, y_function, colsep, vectorized): # One line of make_table, without the row separator
+    task = getattr(y_function, "__name__", repr(y_function))
+    if vectorized:
+        xs = np.array(distances, dtype=float)
+        values = y_function(weapon,xs) if instrument.active is None else _timed(weapon, None, task, y_function, weapon, xs)
+        cells = [*weapon.info()]+np.broadcast_to(values, (len(distances),)).tolist()
+    elif instrument.active is None: cells = [*weapon.info()]+[y_function(weapon,x) for x in distances]
+    else: cells = [*weapon.info()]+[_timed(weapon, x, task, y_function, weapon, x) for x in distances]
+    return colsep.join([str(c) for c in cells])
+
+def _prepare_worker(pids, initializer, initargs): # Workers leave Ctrl-C to the main process, and tell it who they are, so it can then stop all of them
+    signal(SIGINT, SIG_IGN)
+    pids.put(getpid())
+    if initializer is not None: initializer(*initargs)
+
+def worker_pool(workers, initializer=None, initargs=()): # (ProcessPoolExecutor, pids) for stop_workers, with initializer(*initargs) run in each worker
+    pids = SimpleQueue()
+    return ProcessPoolExecutor(workers, initializer=_prepare_worker, initargs=(pids, initializer, initargs)), pids
+
+def stop_workers(executor, pids): # Without waiting for what's in progress, and dropping what hasn't started
+    executor.shutdown(wait=False, cancel_futures=True)
+    while not pids.empty():
+        try: kill(pids.get(), SIGTERM)
+        except OSError: pass # Already gone
+
+def _for_each_weapon(jobs, row_function, workers, on_row): # on_row(i, row_function(*jobs[i])) in order of i, with that many processes; jobs[i][0] is the weapon
+    if workers<=1:
+        for i, job in enumerate(jobs):
+            print("Calculating:",job[0])
+            on_row(i, row_function(*job))
+        return
+    finished, next_row = {}, 0 # Rows that finished early wait here until the ones before them are done
+    report = instrument.active # The workers can't add to it, so they send their own along with each row
+    executor, pids = worker_pool(workers)
+    try:
+        futures = {(executor.submit(row_function, *job) if report is None else executor.submit(instrument.collect, row_function, *job)):i for i,job in enumerate(jobs)}
+        for done, future in enumerate(as_completed(futures)):
+            finished[futures[future]] = future.result()
+            if report is not None:
+                finished[futures[future]], worker_report = finished[futures[future]]
+                report.merge(worker_report)
+            print("Calculated (%d/%d):"%(done+1,len(jobs)), jobs[futures[future]][0])
+            while next_row in finished:
+                on_row(next_row, finished.pop(next_row))
+                next_row += 1
+    except BaseException: # Also on Ctrl-C: drop the rows that haven't started, and stop the ones in progress
+        stop_workers(executor, pids)
+        raise
+    executor.shutdown()
+
+def make_table(weapons, distances, y_function, colsep=';', rowsep='\n', vectorized=False, workers=1): # y_function is any function that takes a weapon and a distance and returns a number
+    # With vectorized=True, y_function is called once per weapon with a NumPy array of all distances instead, and must return an array
+    # With workers>1, the rows are calculated in that many processes; y_function must then be defined at module level (not a lambda), so it can be sent there
+    rows = [_header(distances, colsep)]
+    _for_each_weapon([(weapon, distances, y_function, colsep, vectorized) for weapon in weapons], _row, workers, lambda i, row: rows.append(row))
+    return "".join(row+rowsep for row in rows)
+
+# Metrics that make_tables can calculate, as {name: (source, function, vectorized)}; add more with register_metric
+# The sources are the expensive parts (simulations), so each one is only calculated once per weapon and distance, and shared by all metrics that use it
+metrics = {}
+metric_sources = {"shot":one_shot, "burst":one_burst, "mag":one_mag}
+
+def register_metric(name, function, source=None, vectorized=False):
+    # source=None: function(weapon, distance) reads the stats directly, like for make_table (and vectorized means the same as there)
+    # Otherwise, function(event, hp) takes the result of metric_sources[source](weapon, distance) and the target's max_hp (100 in the tables,
+    # see matchups for others), e.g. lambda e, hp: e.kill_time(0.8, hp) with source "burst"
+    if source is not None and source not in metric_sources: raise KeyError("Unknown source '%s'"%source)
+    if source is not None:
+        try: signature(function).bind(None, None)
+        except TypeError: raise TypeError("Metric '%s' has a source, so it must take (event, hp)"%name) from None
+        except ValueError: pass # No signature to check (e.g. some built-in functions)
+    metrics[name] = (source, function, vectorized)
+
+def _cells(weapon, distances, metrics, sources): # {name: the cells of the weapon's row in that table, as text}
+    return {name:[str(c) for c in row] for name, row in _values(weapon, distances, metrics, sources).items()}
+
+def _values(weapon, distances, metrics, sources): # Same as _cells, as numbers
+    xs = None
+    cells = {name:[] for name in metrics}
+    for name, (source, function, vectorized) in metrics.items():
+        if source is None and vectorized and np is not None:
+            if xs is None: xs = np.array(distances, dtype=float)
+            values = function(weapon,xs) if instrument.active is None else _timed(weapon, None, name, function, weapon, xs)
+            cells[name] = np.broadcast_to(values, xs.shape).tolist()
+    for x in distances:
+        results = {}
+        for name, (source, function, vectorized) in metrics.items():
+            if source is None:
+                if not (vectorized and np is not None): cells[name].append(function(weapon,x) if instrument.active is None else _timed(weapon, x, name, function, weapon, x))
+            else:
+                if source not in results: results[source] = sources[source](weapon,x) if instrument.active is None else _timed(weapon, x, source, sources[source], weapon, x)
+                cells[name].append(function(results[source], default_target[1]))
+    for name, row in cells.items(): # Tables and the database only take numbers, so a metric that returns something else fails at its first row, not at the end
+        for value in row:
+            if not isinstance(value, Real): raise TypeError("Metric '%s' returned %r for %s, which isn't a number"%(name, value, weapon))
+    return cells
+
+def _info(weapon):
+    return [str(c) for c in weapon.info()]
+
+def make_tables(weapons, distances, names=None, colsep=';', rowsep='\n', workers=1, sources=None): # {name: table} for the given metrics (or all of them), in one pass
+    # sources can replace some of the metric_sources, e.g. {"mag":markov_mag}; workers is the same as for make_table
+    names = list(metrics) if names is None else list(names)
+    sources = dict(metric_sources, **(sources or {}))
+    tables = {name:[_header(distances, colsep)] for name in names}
+    def add(i, cells):
+        for name in names: tables[name].append(colsep.join(_info(weapons[i])+cells[name]))
+    _for_each_weapon([(weapon, distances, {name:metrics[name] for name in names}, sources) for weapon in weapons], _cells, workers, add)
+    return {name:"".join(row+rowsep for row in rows) for name, rows in tables.items()}
+
+# Matchups: the same metrics against a grid of targets at one distance, with targets as (armor, max_hp, cover), e.g. ((4,40), 100, False)
+def target_grid(armors=((0,0),), hps=(100,), covers=(False,)): # Every combination
+    return [(tuple(armor), hp, cover) for armor in armors for hp in hps for cover in covers]
+
+def target_label(target):
+    (piercing, coverage), hp, cover = target
+    return "%s/%s armor, %s hp%s"%(piercing, coverage, hp, ", in cover" if cover else "")
+
+def _effective(weapon, distance, target): # The target as the weapon sees it: armor it penetrates is the same as none, and so is any other armor it doesn't
+    (piercing, coverage), hp, cover = target
+    if coverage<=0 or weapon.penetration(distance)>=piercing: return (0,0), hp, cover
+    return (inf,coverage), hp, cover
+
+def _caps_hp(function, weapon, distance): # Whether function's result for a lower max_hp is the one for a higher max_hp, capped there
+    # True for shots (a crit does max_hp, so it's a kill either way) and bursts of a fixed length, but not for anything that stops when the
+    # target is dead (one_mag, or bursts that fire until then), or rounds damage (like an Approximation)
+    return function is one_shot or (function is one_burst and weapon.burst(distance)[1]>=0)
+
+def matchups(weapons, targets, distance=10, names=None, sources=None): # {name: [[value against each target] for each weapon]}
+    # names are metrics (see register_metric), by default all that use a simulation; these get the target's max_hp
+    # Targets that look the same to a weapon are only simulated once, and for the ones with the same armor and cover, shots and fixed-length
+    # bursts are only calculated for the highest hp among them, and capped at each of the others (see _caps_hp)
+    names = [name for name in metrics if metrics[name][0] is not None] if names is None else list(names)
+    sources = dict(metric_sources, **(sources or {}))
+    values = {name:[] for name in names}
     for weapon in weapons:
-        print("Calculating:",weapon)
-        cells = [*weapon.info()]+[y_function(Cached(weapon),x) for x in distances]
-        table += colsep.join([str(c) for c in cells])+rowsep
-    return table
+        profiles = [_effective(weapon, distance, target) for target in targets]
+        highest = {} # {(armor, cover): highest hp}
+        for armor, hp, cover in profiles: highest[armor, cover] = max(hp, highest.get((armor, cover), hp))
+        results = {} # {(source, effective target): event}
+        def event(source, profile):
+            if (source, profile) not in results:
+                armor, hp, cover = profile
+                if hp<highest[armor, cover] and _caps_hp(sources[source], weapon, distance):
+                    results[source, profile] = event(source, (armor, highest[armor, cover], cover)).capped(hp)
+                else: results[source, profile] = sources[source](weapon, distance, max_hp=hp, armor=armor, cover=cover)
+            return results[source, profile]
+        rows = {name:[] for name in names}
+        for profile in profiles:
+            for name in names:
+                source, function, _ = metrics[name]
+                if source is None: rows[name].append(function(weapon, distance))
+                else: rows[name].append(function(event(source, profile), profile[1]))
+        for name in names: values[name].append(rows[name])
+    return values
+
+def make_matchup_tables(weapons, targets, distance=10, names=None, colsep=';', rowsep='\n', sources=None): # Same as make_tables, with a column for each target instead of each distance
+    header = _header([target_label(target) for target in targets], colsep)
+    return {name:"".join(row+rowsep for row in [header]+[colsep.join(_info(weapon)+[str(c) for c in cells]) for weapon, cells in zip(weapons, rows)])
+            for name, rows in matchups(weapons, targets, distance, names, sources).items()}
+
+def _function_id(f): # Name of a function (with its fixed arguments, for a partial), the same from one run to the next
+    if isinstance(f, partial):
+        return "%s(%s)"%(_function_id(f.func), ", ".join([repr(a) for a in f.args]+["%s=%r"%kv for kv in sorted(f.keywords.items())]))
+    return "%s.%s"%(getattr(f, "__module__", None), getattr(f, "__qualname__", repr(f)))
+
+def _unnamed(f): # Lambdas and local functions, whose _function_id is the same for all of them
+    return f is not None and "<" in _function_id(f)
+
+_RESULT_VERSION = 2 # Increase when the simulations (or the metrics) give different results, so rows stored by an older version are calculated again
+
+class ResultStore: # Rows calculated earlier, by Weapon.fingerprint(), metric and distances; one small file per row, so saving one is cheap and can't break the others
+    def __init__(self, path=join(default_cache, "results")):
+        self.path = path
+    
+    @staticmethod
+    def key(weapon, distances, metric, source, name=None): # name is the metric's registered name; None if the row can't be told apart from others
+        # A lambda or local function (as metric or source) can't be recognized from one run to the next, so a metric that is one needs a name,
+        # and rows from a source that is one aren't stored at all
+        if _unnamed(source) or (_unnamed(metric) and name is None): return None
+        parts = [str(_RESULT_VERSION), weapon.fingerprint(), name or "", _function_id(metric), _function_id(source) if source else "", repr([float(x) for x in distances])]
+        return sha1("\0".join(parts).encode()).hexdigest()
+    
+    def _file(self, key):
+        return join(self.path, key[:2], key)
+    
+    def get(self, key): # The cells, or None if there are none yet
+        try:
+            with open(self._file(key)) as f: content = f.read()
+        except OSError: return None
+        return content.split("\n")[:-1]
+    
+    def put(self, key, cells):
+        makedirs(join(self.path, key[:2]), exist_ok=True)
+        _replace_file(self._file(key), "".join(c+"\n" for c in cells))
+
+def _row_key(row, colsep): # The Weapon.info() part of a table row
+    return colsep.join(row.split(colsep)[:4])
+
+def _read_table(filename, header, colsep, rowsep): # {row key: row} of a table written earlier, or {} if it's missing or for a different x-axis
+    try:
+        with open(filename) as f: content = f.read()
+    except OSError: return {}
+    rows = content.split(rowsep)[:-1] # Anything after the last row separator was cut off mid-row
+    if not rows or rows[0]!=header: return {}
+    return {_row_key(row, colsep):row for row in rows[1:]}
+
+def _replace_file(filename, content): # Atomically, so an interruption leaves either the old or the new version
+    with open(filename+".tmp", 'w') as f: f.write(content)
+    replace(filename+".tmp", filename)
+
+def write_tables(weapons, distances, outdir="output", names=None, colsep=';', rowsep='\n', workers=1, sources=None, resume=False, store=None, database=None):
+    # Like make_tables, but writes the tables to outdir/<name>.csv, and each row as soon as it is done, so an interruption only loses the rows in progress
+    # With resume=True, rows that are already in the files (same weapon/ammo/scope/cover and x-axis) are kept and not calculated again
+    # With a ResultStore, rows are also taken from there if the weapon's XML, the metric and the x-axis are the same, and new rows are added to it
+    # Either way, the finished files are the same as if everything was calculated in one go
+    # With a ResultDatabase, the finished tables are also written there (see database.py)
+    makedirs(outdir, exist_ok=True)
+    names = list(metrics) if names is None else list(names)
+    sources = dict(metric_sources, **(sources or {}))
+    header = _header(distances, colsep)
+    filenames = {name:join(outdir, name+".csv") for name in names}
+    existing = {name:_read_table(filenames[name], header, colsep, rowsep) if resume else {} for name in names}
+    keys = [colsep.join(_info(weapon)) for weapon in weapons]
+    todo = [i for i,key in enumerate(keys) if any(key not in existing[name] for name in names)]
+    if resume: print("Resuming: %d of %d rows already done"%(len(weapons)-len(todo),len(weapons)))
+    reused, calculated = sum(key in existing[name] for key in keys for name in names)*len(distances), 0
+    files = {}
+    try:
+        for name in names:
+            _replace_file(filenames[name], "".join(row+rowsep for row in [header]+list(existing[name].values())))
+            files[name] = open(filenames[name], 'a')
+        def add(i, cells):
+            for name, row in cells.items():
+                if keys[i] in existing[name]: continue
+                existing[name][keys[i]] = colsep.join(_info(weapons[i])+row)
+                files[name].write(existing[name][keys[i]]+rowsep)
+                files[name].flush()
+        jobs, stored = [], {}
+        for i in todo:
+            missing = {name:metrics[name] for name in names if keys[i] not in existing[name]}
+            if store is not None:
+                stored[i] = {name:store.key(weapons[i], distances, metrics[name][1], sources.get(metrics[name][0]), name) for name in missing}
+                stored[i] = {name:key for name, key in stored[i].items() if key is not None}
+                found = {name:store.get(key) for name, key in stored[i].items()}
+                found = {name:cells for name, cells in found.items() if cells is not None and len(cells)==len(distances)}
+                add(i, found)
+                reused += len(found)*len(distances)
+                missing = {name:m for name, m in missing.items() if name not in found}
+            if missing: jobs.append((i, missing))
+        def calculate(j, cells):
+            nonlocal calculated
+            i = jobs[j][0]
+            add(i, cells)
+            calculated += len(cells)*len(distances)
+            if store is not None:
+                for name, row in cells.items():
+                    if name in stored[i]: store.put(stored[i][name], row)
+        _for_each_weapon([(weapons[i], distances, missing, sources) for i, missing in jobs], _cells, workers, calculate)
+    finally:
+        for f in files.values(): f.close()
+        print("Reused %d cells, calculated %d"%(reused, calculated))
+    for name in names: # Rows from earlier runs may be out of order (or belong to weapons that are no longer in the list)
+        _replace_file(filenames[name], "".join(row+rowsep for row in [header]+[existing[name][key] for key in keys]))
+    if database is not None:
+        for name in names:
+            source, function, _ = metrics[name]
+            for weapon, key in zip(weapons, keys):
+                database.put(weapon.info(), name, distances, existing[name][key].split(colsep)[4:], default_target, source, _function_id(sources[source] if source else function))
+        database.commit()
+
+def _adaptive_values(weapon, metrics, sources, options): # _refine for all metrics at once, so each simulation is still only run once per distance
+    return _refine(weapon, lambda x: [row[0] for row in _values(weapon, [x], metrics, sources).values()], **options)
+
+def write_adaptive_tables(weapons, outdir="output", names=None, colsep=';', rowsep='\n', workers=1, sources=None, database=None, **options):
+    # Like write_tables, at the distances from adaptive_axis (with these options), which all tables share; a weapon's curves are only refined
+    # where one of them needs it. Since the axis is only known at the end, so are the tables, and there is no resume or ResultStore here
+    makedirs(outdir, exist_ok=True)
+    names = list(metrics) if names is None else list(names)
+    sources = dict(metric_sources, **(sources or {}))
+    selected = {name:metrics[name] for name in names}
+    found = [None]*len(weapons)
+    def add(i, points): found[i] = points
+    _for_each_weapon([(weapon, selected, sources, options) for weapon in weapons], _adaptive_values, workers, add)
+    values_at = lambda i, x: [row[0] for row in _values(weapons[i], [x], selected, sources).values()]
+    calculated = sum(len(points) for points in found)*len(names)
+    axis, found = _combine(weapons, found, values_at, **options)
+    print("Calculated %d of %d cells, the rest is taken from the curves between them"%(calculated, len(weapons)*len(axis)*len(names)))
+    header = _header(axis, colsep)
+    for k, name in enumerate(names):
+        rows = [colsep.join(_info(weapon)+[str(points[x][k]) for x in axis]) for weapon, points in zip(weapons, found)]
+        _replace_file(join(outdir, name+".csv"), "".join(row+rowsep for row in [header]+rows))
+    if database is not None:
+        for k, name in enumerate(names):
+            source, function, _ = metrics[name]
+            for weapon, points in zip(weapons, found):
+                database.put(weapon.info(), name, axis, [points[x][k] for x in axis], default_target, source, _function_id(sources[source] if source else function))
+        database.commit()
+
+# The metrics written when run from the command line; defined here rather than as lambdas, so they can be sent to worker processes
+def base_damage(w,x): return w.damage(x)
+def accuracy(w,x): return w.accuracy(x)
+def crit_chance(w,x): return w.crit_chance(x)
+def aim_time(w,x): return w.aim_time(x)
+def rate_of_fire(w,x): return 1000.0/w.cycle_time(x)
+# The ones that take an event also take the target's max_hp (see register_metric)
+def expected_time(e, hp=100): return e.expected()[0]
+def expected_damage(e, hp=100): return e.expected()[1]
+def kill_chance(e, hp=100): return e.kill_chance(hp)
+def dps(e, hp=100): return e.dps()
+def kill_time_50(e, hp=100): return e.kill_time(0.5, hp)
+def kill_time_95(e, hp=100): return e.kill_time(0.95, hp)
+
+register_metric("base_damage", base_damage, vectorized=True)
+register_metric("accuracy", accuracy, vectorized=True)
+register_metric("crit_chance", crit_chance, vectorized=True)
+register_metric("aim_time", aim_time, vectorized=True)
+register_metric("rate_of_fire", rate_of_fire, vectorized=True)
+register_metric("effective_damage", expected_damage, "shot")
+register_metric("burst_kill_chance", kill_chance, "burst")
+register_metric("burst_time", expected_time, "burst")
+register_metric("burst_damage", expected_damage, "burst")
+register_metric("damage_per_second", dps, "burst")
+register_metric("kill_time_50_percent", kill_time_50, "burst")
+register_metric("kill_time_95_percent", kill_time_95, "burst")
+register_metric("damage_per_second_with_reload", dps, "mag")
+register_metric("kill_time_50_percent_with_reload", kill_time_50, "mag")
+register_metric("kill_time_95_percent_with_reload", kill_time_95, "mag")
 
 if __name__=="__main__":
-    from sys import argv
-    from os import makedirs
-    try: data = Data(argv[1])
-    except: data = Data()
+    parser = arguments("Write tables of weapon stats for all weapons in the game data.")
+    parser.add_argument("--engine", choices=sorted(mag_engines), default="exact", help="how to simulate full magazines (the *_with_reload tables)")
+    parser.add_argument("--samples", type=int, default=10000, help="number of simulated engagements per point with --engine montecarlo")
+    parser.add_argument("--time-step", type=int, default=1, help="round times to multiples of this (in ms) in the burst and mag tables, for speed over accuracy")
+    parser.add_argument("--damage-step", type=int, default=1, help="round damage down to multiples of this in the burst and mag tables")
+    parser.add_argument("--eps", type=float, default=Event.eps, help="drop branches that are less likely than this in the burst and mag tables")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to calculate the tables in (0: one per CPU core)")
+    parser.add_argument("--profile", metavar="FILE", help="count and time what the simulations do, and write a report of the slowest weapons and cells to FILE (as JSON)")
+    parser.add_argument("--resume", action="store_true", help="keep the rows that are already in the output tables, and only calculate the missing ones")
+    parser.add_argument("--database", default="output/results.sqlite", help="SQLite file to also write the results to, for database.py")
+    parser.add_argument("--adaptive", action="store_true", help="choose the distances from the curves themselves (see adaptive_axis) instead of a fixed grid, for far fewer simulations")
+    args = parser.parse_args()
+    if args.adaptive and args.resume: parser.error("--resume needs the fixed grid, so it can't be used with --adaptive")
+    data = load(args)
+    print(data.cache_report())
+    mag = mag_engines[args.engine]
+    if args.engine=="montecarlo": mag = partial(sample_mag, samples=args.samples, seed=0) # Seeded, so the tables don't change between runs
+    sources = {"mag":mag}
+    approximation = Approximation(args.time_step, args.damage_step, args.eps)
+    exact_mag = one_mag
+    if approximation!=Approximation():
+        sources["burst"] = partial(one_burst, backend=approximation)
+        exact_mag = partial(one_mag, backend=approximation)
+        if args.engine=="exact": sources["mag"] = exact_mag
     weapons = match_weapons(data)
     #weapons = match_weapons(data, sides=["Enemy"])
     #weapons = match_weapons(data, classes=["Assault"], slots=["Primary"])
@@ -72,25 +518,19 @@ if __name__=="__main__":
     cuts = all_cutoffs(weapons)
     xs = x_axis(range(0,101,5),cuts)
     outdir = "output/"
-    makedirs(outdir, exist_ok=True)
-    tasks = [
-        ("base_damage.csv", lambda w,x: w.damage(x)),
-        ("accuracy.csv", lambda w,x: w.accuracy(x)),
-        ("crit_chance.csv", lambda w,x: w.crit_chance(x)),
-        ("aim_time.csv", lambda w,x: w.aim_time(x)),
-        ("rate_of_fire.csv", lambda w,x: 1000.0/w.cycle_time(x)),
-        ("effective_damage.csv", lambda w,x: one_shot(w,x).expected()[1]),
-        ("burst_kill_chance.csv", lambda w,x: one_burst(w,x).kill_chance()),
-        ("burst_time.csv", lambda w,x: one_burst(w,x).expected()[0]),
-        ("burst_damage.csv", lambda w,x: one_burst(w,x).expected()[1]),
-        ("damage_per_second.csv", lambda w,x: one_burst(w,x).dps()),
-        ("kill_time_50_percent.csv", lambda w,x: one_burst(w,x).kill_time(0.5)),
-        ("kill_time_95_percent.csv", lambda w,x: one_burst(w,x).kill_time(0.95)),
-        ("damage_per_second_with_reload.csv", lambda w,x: one_mag(w,x).dps()),
-        ("kill_time_50_percent_with_reload.csv", lambda w,x: one_mag(w,x).kill_time(0.5)),
-        ("kill_time_95_percent_with_reload.csv", lambda w,x: one_mag(w,x).kill_time(0.95))
-        ]
-    for filename, yfunc in tasks:
-        print("Next table:",outdir+filename)
-        with open(outdir+filename,'w') as f:
-            f.write(make_table(weapons, xs, yfunc))
+    if args.profile: instrument.enable()
+    try:
+        store = None if args.no_cache else ResultStore(join(args.cache, "results"))
+        names = list(metrics)
+        if args.engine=="markov": # It has no kill times, so those tables are still calculated with one_mag
+            names = [name for name in metrics if not (metrics[name][0]=="mag" and metrics[name][1] in (kill_time_50, kill_time_95))]
+        with ResultDatabase(args.database) as database:
+            def write(names, sources):
+                if args.adaptive: write_adaptive_tables(weapons, outdir, names, workers=args.workers or cpu_count(), sources=sources, database=database)
+                else: write_tables(weapons, xs, outdir, names, workers=args.workers or cpu_count(), sources=sources, resume=args.resume, store=store, database=database)
+            write(names, sources)
+            if len(names)<len(metrics): write([name for name in metrics if name not in names], dict(sources, mag=exact_mag))
+    except KeyboardInterrupt:
+        raise SystemExit("Cancelled." if args.adaptive else "Cancelled; run again with --resume to continue where it stopped.")
+    finally: # Also for a cancelled run, which is when it's most interesting
+        if args.profile: instrument.disable().save(args.profile)
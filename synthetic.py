@@ -0,0 +1,104 @@
+from os import makedirs
+from os.path import join
+from random import Random
+from xml.sax.saxutils import quoteattr
+
+# Writes a made-up equipment/ directory with the same layout as the game's files, so the other modules can be run
+# (and timed) without a Door Kickers 2 install. The numbers are plausible, not real; scale sets the number of items.
+
+def _attrs(**kwargs):
+    return "".join(" %s=%s"%(k,quoteattr(str(v))) for k,v in kwargs.items() if v is not None)
+
+def _tag(tag, children=(), **kwargs):
+    if not children: return "<%s%s/>"%(tag,_attrs(**kwargs))
+    return "<%s%s>%s</%s>"%(tag,_attrs(**kwargs),"".join(children),tag)
+
+def _ramp(tag, rng, start, end, maxdist=60):
+    d0 = rng.choice([0,5,10,15])
+    return _tag(tag, startDist=d0, endDist=d0+rng.randint(10,maxdist), start=start, end=end)
+
+def _attack_types(rng, count):
+    kinds = [("Single",1,1),("Double",2,2),("Burst",3,3),("Spray",2,5),("Auto",3,-1)]
+    ats = []
+    for i in range(count):
+        kind, smin, smax = kinds[i%len(kinds)]
+        params = dict(accuracyAdd=rng.randint(-25,10), critChanceAdd=rng.randint(-5,5), followupShotAccuracyAdd=rng.randint(-8,0),
+                      minShots=smin, maxShots=smax, minAimTime=rng.randint(100,300), maxAimTime=rng.randint(300,900), resetTime=rng.randint(50,400))
+        if rng.random()<0.3: params["roundsPerSecondOverride"] = rng.randint(4,15)
+        ats.append(_tag("AttackType", [_tag("ModifiableParams", **params)], name="AT_%s_%d"%(kind,i)))
+    return ats
+
+def _ammo(rng, name, shotgun=False):
+    params = dict(roundsPerSecond=rng.randint(6,16), numPellets=8 if shotgun else None)
+    children = [_ramp("Damage", rng, rng.randint(12,40) if shotgun else rng.randint(30,90), rng.randint(4,20)),
+                _ramp("CriticalChancePercent", rng, rng.randint(5,30), rng.randint(0,10)),
+                _ramp("ArmorPenetration", rng, rng.randint(2,8), rng.randint(0,4))]
+    return _tag("Ammo", [_tag("Params", children, **params)], name=name)
+
+def _scope(rng, name, slot):
+    mods, d = [], 0
+    for _ in range(rng.randint(1,3)):
+        d2 = d+rng.randint(5,40)
+        mods.append(_tag("AttackTypeModifier", [_tag("AddTo", accuracyAdd=rng.randint(-10,20), critChanceAdd=rng.randint(-3,6), minAimTime2=rng.randint(0,150), maxAimTime2=rng.randint(0,300), resetTime=rng.randint(0,100))], minRange=d, maxRange=d2))
+        d = d2
+    equip = _tag("EquipmentModifier", [_tag("AddTo", guardTime=rng.randint(0,100), readyTime=rng.randint(0,100), reloadTime=rng.randint(0,200), reloadEmptyTime=rng.randint(0,200))])
+    return _tag("Scope", [_tag("Params", mods), equip], name=name, inventoryBinding=slot)
+
+def _firearm(rng, name, slot, ammo, scopes, attacks, classes, archetype):
+    capacity = {"mg":rng.choice([75,100,150]), "shotgun":rng.choice([5,7,8]), "pistol":rng.choice([7,13,17])}.get(archetype, rng.choice([20,30]))
+    params = _tag("ModifiableParams", accuracyStartDist=rng.choice([0,5]), accuracyEndDist=rng.randint(20,80), accuracyStart=rng.randint(60,90), accuracyEnd=rng.randint(20,60),
+                  numPellets=8 if archetype=="shotgun" else 1, roundsPerMagazine=capacity, closedBolt=int(archetype not in ("mg","shotgun")),
+                  guardTime=rng.randint(100,400), readyTime=rng.randint(100,400), reloadTime=rng.randint(1500,3000), reloadEmptyTime=rng.randint(2000,5000))
+    ranges, r = [], 0
+    for _ in range(rng.randint(1,3)):
+        r += rng.randint(5,40)
+        ranges.append(r)
+    ats = []
+    for r in ranges:
+        at = rng.choice(attacks)
+        ats.append(_tag("AttackType", name=at, rangeMeters=r, inCoverOverride=rng.choice(attacks) if archetype=="mg" else None))
+    children = [params, _tag("AttackTypes", ats), _tag("AmmoTypes", [_tag("Ammo", name=a) for a in ammo])]
+    if scopes: children.append(_tag("ScopeTypes", [_tag("Scope", name=s) for s in scopes]))
+    children += [_tag("ClassBinding", name=c) for c in classes]
+    return _tag("Firearm", children, name=name, inventoryBinding=slot)
+
+def _write(path, root, items):
+    with open(path, 'w') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<%s>\n%s\n</%s>\n'%(root,"\n".join(items),root))
+
+def generate(datapath="synthetic", scale=1, seed=0):
+    rng = Random(seed)
+    equipment = join(datapath, "equipment")
+    makedirs(equipment, exist_ok=True)
+    attacks = _attack_types(rng, 10*scale)
+    attack_names = ["AT_%s_%d"%(k,i) for i,k in enumerate(["Single","Double","Burst","Spray","Auto"]*(2*scale))]
+    scopes = ["IronSights"]+["Scope%d"%i for i in range(6*scale)]
+    pistol_scopes = ["PistolIronSights"]
+    _write(join(equipment,"firearm_attacktypes.xml"), "FirearmAttackTypes", attacks)
+    _write(join(equipment,"firearm_scopes.xml"), "Equipment", [_scope(rng,s,"PrimaryWeaponScope") for s in scopes]+[_scope(rng,s,"SecondaryWeaponScope") for s in pistol_scopes])
+    ammo, files = [], {"firearms_rifles":[], "firearms_cia":[], "firearms_pistols":[], "firearms_pistols_cia":[], "firearms_enemy":[]}
+    archetypes = ["rifle","rifle","mg","shotgun","marksman"]
+    for fn, slot, count in [("firearms_rifles","PrimaryWeapon",10), ("firearms_cia","PrimaryWeapon",3), ("firearms_pistols","SecondaryWeapon",3), ("firearms_pistols_cia","SecondaryWeapon",2), ("firearms_enemy",None,6)]:
+        for i in range(count*scale):
+            archetype = "pistol" if "pistols" in fn else archetypes[i%len(archetypes)]
+            wslot = slot or rng.choice(["PrimaryWeapon","SecondaryWeapon"])
+            name = "%s %s %d"%(fn.split('_')[-1].capitalize(), archetype, i)
+            wammo = ["%s_%s%d_%d"%(a,fn.split('_',1)[1],i,j) for j,a in enumerate(rng.sample(["556FMJ","556AP","762FMJ","762HP","9mmFMJ"],rng.randint(1,3)))]
+            ammo += [_ammo(rng, a, archetype=="shotgun") for a in wammo]
+            wscopes = None if fn=="firearms_enemy" else pistol_scopes if wslot=="SecondaryWeapon" else ["IronSights"]+rng.sample(scopes[1:],min(3,len(scopes)-1))
+            classes = [] if fn=="firearms_enemy" else rng.sample(["Assault","Support","Marksman","Medic","Grenadier","Undercover","BlackOps"],2)
+            files[fn].append(_firearm(rng, name, wslot, wammo, wscopes, attack_names, classes, archetype))
+    _write(join(equipment,"firearm_ammo.xml"), "Equipment", ammo)
+    for fn, items in files.items():
+        _write(join(equipment,fn+".xml"), "Equipment", items)
+    _write(join(equipment,"armors.xml"), "Equipment", [_tag("Armor", name="Vest%d"%i, inventoryBinding="Armor") for i in range(3*scale)])
+    return datapath
+
+if __name__=="__main__":
+    from argparse import ArgumentParser
+    parser = ArgumentParser(description="Write made-up game data, to run the other modules on.")
+    parser.add_argument("datapath", nargs="?", default="synthetic", help="directory to write it to (use it as the data directory for the others)")
+    parser.add_argument("--scale", type=int, default=1, help="multiplies the number of weapons, ammo, scopes and attack types (1: about 150 weapon combinations)")
+    parser.add_argument("--seed", type=int, default=0, help="different seeds give different (but just as plausible) items")
+    args = parser.parse_args()
+    print("Wrote", generate(args.datapath, args.scale, args.seed))
@@ -1,5 +1,13 @@
 from extract import *
 from math import *
+from bisect import bisect_left
+from hashlib import sha1
+from collections import OrderedDict
+from functools import wraps
+import inspect
+import instrument
+try: import numpy as np # Optional; only needed to pass arrays of distances to the stats
+except ImportError: np = None
 
 # Helper function for interpolation; this gets used a lot for distance-dependend stats
 # Options for values outside range are clamp to edge and clamp to zero; the game never seems to extrapolate
@@ -7,23 +15,112 @@ def _ip(x, x0, x1, y0, y1, zero=False):
     if x0>x1: return _ip(x, x1, x0, y1, y0, zero)
     if x<x0: return 0 if zero else y0
     elif x>x1: return 0 if zero else y1
+    elif x1==x0: return y1
     r = (x-x0)/(x1-x0)
     return (1-r)*y0+r*y1
 
+def _ramp_knots(params, start="startDist", end="endDist"): # Distances at which an interpolated stat starts and stops changing
+    try: return [float(params[start]), float(params[end])]
+    except: return []
+
+def _child(elem, *path): # Like elem.path[0].path[1]..., but None if anything along the way is missing
+    try:
+        for p in path: elem = getattr(elem, p)
+        return elem
+    except: return None
+
+# Stats that can't be read are stored as the exception, and raised whenever they are asked for (just like reading them directly would)
+def _resolve(f, *args):
+    try: return f(*args)
+    except Exception as e: return e
+
+def _value(v):
+    if isinstance(v, Exception): raise v
+    return v
+
+class _Piecewise: # A distance-dependent stat, resolved into a table: exact at the knots, linear (or constant) between them
+    __slots__ = ("knots", "at", "base", "slope", "_arrays")
+    def __init__(self, stat, knots, linear=True): # stat(x,y) is the stat at distance x, using the attack type/scope settings active at distance y
+        k = sorted(set(knots)) or [0.0]
+        lo, hi = k[:1]+k, k+k[-1:] # Interval i lies between k[i-1] and k[i]; the first and last one are open-ended (and constant)
+        mids = [k[0]-1]+[(a+b)/2 for a,b in zip(k,k[1:])]+[k[-1]+1]
+        self.knots = k
+        self.at = [_resolve(stat,x,x) for x in k]
+        self.base = [_resolve(stat,l,m) for l,m in zip(lo,mids)]
+        self.slope = None
+        if linear:
+            ends = [_resolve(stat,h,m) for h,m in zip(hi,mids)]
+            self.slope = [0 if h==l or b==e or isinstance(b,Exception) or isinstance(e,Exception) else (e-b)/(h-l) for l,h,b,e in zip(lo,hi,self.base,ends)]
+        self._arrays = None
+    
+    def __call__(self, x):
+        if instrument.active is not None: instrument.active.count("Weapon stat lookups", x.size if np is not None and isinstance(x, np.ndarray) else 1)
+        if np is not None and isinstance(x, np.ndarray): return self._sweep(x)
+        i = bisect_left(self.knots, x)
+        if i<len(self.knots) and self.knots[i]==x: return _value(self.at[i])
+        if self.slope is None or not self.slope[i]: return _value(self.base[i])
+        return self.base[i]+(x-self.knots[i-1])*self.slope[i]
+    
+    def _sweep(self, x): # Same as __call__, for a whole array of distances at once
+        if self._arrays is None:
+            def array(values): # Mixed ints and floats stay as they are, so the results print the same as the scalar ones
+                values, errors = [0 if isinstance(v,Exception) else v for v in values], [v for v in values if isinstance(v,Exception)]
+                return np.array(values, dtype=object if len({type(v) for v in values})>1 else None), errors
+            self._arrays = (np.array(self.knots, dtype=float), np.array(self.knots[:1]+self.knots, dtype=float), array(self.at), array(self.base),
+                            None if self.slope is None else np.array(self.slope, dtype=float))
+        knots, lo, (at, at_errors), (base, base_errors), slope = self._arrays
+        i = np.searchsorted(knots, x)
+        exact = knots[np.minimum(i,len(knots)-1)]==x
+        if at_errors and exact.any() or base_errors and not exact.all(): # Raise like __call__ would, if any failed value is needed
+            ia = np.minimum(i[exact],len(knots)-1)
+            for v in [self.at[j] for j in ia.tolist()]+[self.base[j] for j in i[~exact].tolist()]: _value(v)
+        y = base[i]
+        if slope is not None: y = np.where(slope[i]!=0, y+(x-lo[i])*slope[i], y)
+        return np.where(exact, at[np.minimum(i,len(knots)-1)], y)
+
+class _Stats: # Every stat of a Weapon as plain numbers (or _Piecewise tables for distance-dependent ones); see Weapon._compile
+    __slots__ = ("cutoffs", "max_range", "pellets", "ammo_capacity", "chamber", "guard_time", "ready_time", "reload_time", "reload_empty_time",
+                 "accuracy", "crit_chance", "damage", "followup_accuracy", "penetration", "burst_min", "burst_max", "aim_time", "reset_time", "cycle_time",
+                 "components")
+
+def _shared(compiled, key, build): # compiled[key], from build() the first time; keys hold XML elements, which are the same object for the same entry
+    if key not in compiled: compiled[key] = build()
+    return compiled[key]
+
+class _Record: # The numbers in an XML element (and its children), each one read once and then shared by all Weapons that use the element
+    __slots__ = ("element", "numbers")
+    def __init__(self, element):
+        self.element = element
+        self.numbers = {}
+    
+    def __call__(self, *path): # float(element.path[0].path[1]...[path[-1]]), raising whatever that would
+        if path not in self.numbers:
+            try: self.numbers[path] = self._read(path)
+            except Exception as e: self.numbers[path] = (type(e), e.args) # Not the exception itself, which would collect the traceback of every raise
+        number = self.numbers[path]
+        if type(number) is tuple: raise number[0](*number[1])
+        return number
+    
+    def _read(self, path):
+        e = self.element
+        for p in path[:-1]: e = getattr(e, p)
+        return float(e[path[-1]])
+
+def _record(compiled, element):
+    return _shared(compiled, ("record", element), lambda: _Record(element))
+
 class Weapon: # Parse all stats of the given Weapon/Ammo/Scope combination
     def __init__(self, dataset, weapon, ammo=None, scope=None, inCover=False): # If None, use the first one that fits; MGs have different attack modes when in cover
-        data = dataset.raw
         self.weapon_raw, self.ammo_raw, self.scope_raw = None, None, None
         self.attacks_raw = []
         self.enemy = False
         self.errors, self.warnings = [], []
+        self._stats, self._fingerprint = None, None
         self.inCover = inCover and dataset.uses_cover(weapon)
         
         # Find raw weapon data
-        if weapon in dataset.list_weapons( False, True, True, True):
-            self.enemy = True
-            self.weapon_raw = data["firearms_enemy"].Equipment.find("Firearm",{"name":weapon})
-        else: self.weapon_raw = dataset.find_weapon_entry(weapon)
+        self.enemy = dataset.is_enemy(weapon)
+        self.weapon_raw = dataset.find_weapon_entry(weapon)
         if not self.weapon_raw:
             self.errors += ["Weapon '%s' not found!"%weapon]
             return
@@ -31,26 +128,26 @@ class Weapon: # Parse all stats of the given Weapon/Ammo/Scope combination
         # Find raw ammo data
         if ammo is None: # None given, simply take the first
             first_ammo = self.weapon_raw.AmmoTypes.Ammo["name"]
-            self.ammo_raw = data["firearm_ammo"].Equipment.find("Ammo",{"name":first_ammo})
-        elif ammo in dataset.list_ammo(): # Full name given; take it but do a sanity check
-            self.ammo_raw = data["firearm_ammo"].Equipment.find("Ammo",{"name":ammo})
+            self.ammo_raw = dataset.find_ammo(first_ammo)
+        elif dataset.is_ammo(ammo): # Full name given; take it but do a sanity check
+            self.ammo_raw = dataset.find_ammo(ammo)
             if not self.weapon_raw.AmmoTypes.find("Ammo",{"name":ammo}):
                 self.warnings += ["Weapon '%s' does not support ammo type '%s', results may be nonsense."%(weapon,ammo)]
         else: # Short name given; see if the weapon supports a matching ammo type, otherwise take the first
             for at in self.weapon_raw.AmmoTypes:
                 if at.name and at["name"].startswith(ammo):
-                    self.ammo_raw = data["firearm_ammo"].Equipment.find("Ammo",{"name":at["name"]})
+                    self.ammo_raw = dataset.find_ammo(at["name"])
             if not self.ammo_raw:
                 first_ammo = self.weapon_raw.AmmoTypes.Ammo["name"]
-                self.ammo_raw = data["firearm_ammo"].Equipment.find("Ammo",{"name":first_ammo})
+                self.ammo_raw = dataset.find_ammo(first_ammo)
                 self.warnings += ["Weapon '%s' does not support ammo type '%s', using '%s' instead."%(weapon,ammo,first_ammo)]
         
         # Find raw scope data
         if scope is None and not self.enemy: # Player weapon must have a scope; if none is given, pick the first (usually IronSights)
             first_scope = self.weapon_raw.ScopeTypes.Scope["name"]
-            self.scope_raw = data["firearm_scopes"].Equipment.find("Scope",{"name":first_scope})
-        elif scope in dataset.list_scopes(): # Full name given; take it but do a sanity check
-            self.scope_raw = data["firearm_scopes"].Equipment.find("Scope",{"name":scope})
+            self.scope_raw = dataset.find_scope(first_scope)
+        elif dataset.is_scope(scope): # Full name given; take it but do a sanity check
+            self.scope_raw = dataset.find_scope(scope)
             if self.enemy:
                 self.warnings += ["Weapon '%s' does not support any scopes, results may be nonsense."%weapon]
                 self.valid = False
@@ -59,18 +156,19 @@ class Weapon: # Parse all stats of the given Weapon/Ammo/Scope combination
                 self.valid = False
         elif not self.enemy:
             first_scope = self.weapon_raw.ScopeTypes.Scope["name"]
-            self.scope_raw = data["firearm_scopes"].Equipment.find("Scope",{"name":first_scope})
+            self.scope_raw = dataset.find_scope(first_scope)
             self.warnings += ["Scope type '%s' does not exist, using '%s' instead."%(scope,first_scope)]
         
         # Find raw attack types
         try:
             attacks = [at for at in list(self.weapon_raw.AttackTypes) if at.name]
-            self.attacks_raw = sorted([(float(at["rangeMeters"]),data["firearm_attacktypes"].FirearmAttackTypes.find("AttackType",{"name":at["name"]})) for at in attacks])
+            self.attacks_raw = sorted([(float(at["rangeMeters"]),dataset.find_attack_type(at["name"])) for at in attacks])
             if inCover:
-                self.attacks_raw = sorted([(float(at["rangeMeters"]),data["firearm_attacktypes"].FirearmAttackTypes.find("AttackType",{"name":at["inCoverOverride"] if at.has_attr("inCoverOverride") else at["name"]})) for at in attacks])
+                self.attacks_raw = sorted([(float(at["rangeMeters"]),dataset.find_attack_type(at["inCoverOverride"] if at.has_attr("inCoverOverride") else at["name"])) for at in attacks])
         except:
             attacks = []
             self.errors += ["Weapon '%s' has not attack types!"%weapon]
+        self._compile(getattr(dataset, "compiled", {}))
             
     def weapon_name(self):
         return self.weapon_raw["name"]
@@ -89,6 +187,14 @@ class Weapon: # Parse all stats of the given Weapon/Ammo/Scope combination
     def __str__(self):
         return str(self.info())
     
+    def fingerprint(self): # Hash of all the XML the stats are read from (weapon, ammo, scope and attack types), so it only changes if they might
+        if self._fingerprint is None:
+            h = sha1(repr(self.inCover).encode())
+            for part in [self.weapon_raw, self.ammo_raw, self.scope_raw]+[at for _,at in self.attacks_raw]:
+                h.update(b"\0"+(part.canonical() if part else "None").encode())
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+    
     def __repr__(self):
         s = "\nWeapon: "+self.weapon_name()
         if self.inCover:
@@ -108,6 +214,9 @@ class Weapon: # Parse all stats of the given Weapon/Ammo/Scope combination
         return [cb["name"] for cb in self.weapon_raw.find_all("ClassBinding")]
             
     def cutoffs(self): # Distances at which stats are not smoothly interpolated (i.e. changes in attack types or scope steps)
+        return list(self._stats.cutoffs)
+    
+    def _cutoffs(self):
         cutoffs={0} | {at[0] for at in self.attacks_raw}
         try:
             cutoffs |= {float(mod["minRange"]) for mod in self.scope_raw.find_all("AttackTypeModifier")}
@@ -116,7 +225,7 @@ class Weapon: # Parse all stats of the given Weapon/Ammo/Scope combination
         return sorted(list(cutoffs))
     
     def can_attack(self, distance):
-        return distance<=self.attacks_raw[-1][0]
+        return distance<=_value(self._stats.max_range)
     
     def attack_type(self, distance):
         for ad,at in self.attacks_raw:
@@ -133,112 +242,273 @@ class Weapon: # Parse all stats of the given Weapon/Ammo/Scope combination
         for atm in self.scope_raw.Params.find_all("AttackTypeModifier"):
             if distance>=float(atm["minRange"]) and distance<=float(atm["maxRange"]):
                 return atm
+    
+    def _compile(self, compiled): # Resolve every stat once, so that queries never have to go back to the XML
+        # Tables that only depend on some of the parts are shared by all Weapons with the same ones, in compiled (see _shared):
+        # damage and penetration only depend on the ammo, and most other stats only on the weapon, scope and attack types (the "sight")
+        self._weapon_record, self._ammo_record, self._scope_record = [_record(compiled, e) for e in (self.weapon_raw, self.ammo_raw, self.scope_raw)]
+        sight = _shared(compiled, ("sight", self.weapon_raw, self.scope_raw, tuple(self.attacks_raw)), lambda: self._compile_sight(compiled))
+        s = _Stats()
+        for name in _Stats.__slots__:
+            if name!="components" and hasattr(sight, name): setattr(s, name, getattr(sight, name))
+        s.damage, s.penetration = _shared(compiled, ("ammo", self.ammo_raw), self._compile_ammo)
+        at = self._at(compiled, sight.components)
+        s.pellets = _resolve(self._pellets)
+        s.crit_chance = _Piecewise(at(self._crit_chance), s.cutoffs+_ramp_knots(_child(self.ammo_raw, "Params", "CriticalChancePercent")))
+        s.cycle_time = _Piecewise(at(self._cycle_time), s.cutoffs, False)
+        self._stats = s
+    
+    def _at(self, compiled, components): # at(stat)(x,y) evaluates a stat at distance x, using the attack type/range and scope modifier that are active at distance y
+        def at(stat):
+            def resolved(x, y):
+                if y not in components: # The same few ones for most distances, so each is only kept once
+                    c = (_record(compiled, self.attack_type(y)), self.attack_ranges(y), _record(compiled, self.scope_mod(y)))
+                    components[y] = _shared(compiled, ("components",)+c, lambda: c)
+                return stat(x, components[y])
+            return resolved
+        return at
+    
+    def _compile_ammo(self): # The tables that only depend on the ammo
+        ammo = _child(self.ammo_raw, "Params")
+        return (_Piecewise(lambda x,y: self._damage(x, None), _ramp_knots(_child(ammo, "Damage"))),
+                _Piecewise(lambda x,y: self._penetration(x, None), _ramp_knots(_child(ammo, "ArmorPenetration"))))
+    
+    def _compile_sight(self, compiled): # The stats that don't depend on the ammo, as a _Stats with the rest left out
+        s = _Stats()
+        s.components = {} # {y: c at distance y}, see _at; also used by the rest of the stats of every Weapon with this sight
+        at = self._at(compiled, s.components)
+        wps = _child(self.weapon_raw, "ModifiableParams")
+        cuts = self._cutoffs()
+        s.cutoffs = cuts
+        s.max_range = _resolve(lambda: self.attacks_raw[-1][0])
+        s.ammo_capacity = _resolve(lambda: int(wps["roundsPerMagazine"]))
+        s.chamber = _resolve(lambda: int(wps["closedBolt"]))
+        s.guard_time = _resolve(self._equipment_time, "guardTime")
+        s.ready_time = _resolve(self._equipment_time, "readyTime")
+        s.reload_time = _resolve(self._equipment_time, "reloadTime")
+        s.reload_empty_time = _resolve(self._equipment_time, "reloadEmptyTime")
+        s.accuracy = _Piecewise(at(self._accuracy), cuts+_ramp_knots(wps, "accuracyStartDist", "accuracyEndDist"))
+        s.followup_accuracy = _Piecewise(at(self._followup_accuracy), cuts, False)
+        s.burst_min = _Piecewise(at(lambda x,c: self._burst(x,c)[0]), cuts, False)
+        s.burst_max = _Piecewise(at(lambda x,c: self._burst(x,c)[1]), cuts, False)
+        s.aim_time = _Piecewise(at(self._aim_time), cuts)
+        s.reset_time = _Piecewise(at(self._reset_time), cuts, False)
+        return s
 
     def accuracy(self, distance=10):
-        wps = self.weapon_raw.ModifiableParams
-        acc = _ip(distance, float(wps["accuracyStartDist"]), float(wps["accuracyEndDist"]), float(wps["accuracyStart"]), float(wps["accuracyEnd"]))
-        try: acc += float(self.attack_type(distance).ModifiableParams["accuracyAdd"])
+        return self._stats.accuracy(distance)
+    
+    def crit_chance(self, distance=10):
+        return self._stats.crit_chance(distance)
+    
+    def damage(self, distance=10):
+        return self._stats.damage(distance)
+    
+    def followup_accuracy(self, distance=10):
+        return self._stats.followup_accuracy(distance)
+    
+    def penetration(self, distance=10):
+        return self._stats.penetration(distance)
+    
+    def pellets(self, distance=None): # distance is irrelevant, param is just for the common interface
+        return _value(self._stats.pellets)
+    
+    def burst(self, distance=10):
+        return self._stats.burst_min(distance), self._stats.burst_max(distance)
+    
+    def ammo_capacity(self, distance=None, withChamber=True):
+        n = _value(self._stats.ammo_capacity)
+        if withChamber: n+=_value(self._stats.chamber)
+        return n
+    
+    def aim_time(self, distance=10):
+        return self._stats.aim_time(distance)
+    
+    def reset_time(self, distance=10):
+        return self._stats.reset_time(distance)
+    
+    def cycle_time(self, distance=10):
+        return self._stats.cycle_time(distance)
+    
+    # For the following params, distance is also irrelevant
+    def guard_time(self, distance=None):
+        return _value(self._stats.guard_time)
+    
+    def ready_time(self, distance=None):
+        return _value(self._stats.ready_time)
+    
+    def reload_time(self, distance=None):
+        return _value(self._stats.reload_time)
+    
+    def reload_empty_time(self, distance=None):
+        return _value(self._stats.reload_empty_time)
+    
+    # The stats as they are read from the XML (through the _Records of the elements); c is the (attack type, attack range, scope modifier) that applies at distance x
+    def _accuracy(self, x, c):
+        wps = self._weapon_record
+        acc = _ip(x, wps("ModifiableParams","accuracyStartDist"), wps("ModifiableParams","accuracyEndDist"), wps("ModifiableParams","accuracyStart"), wps("ModifiableParams","accuracyEnd"))
+        try: acc += c[0]("ModifiableParams","accuracyAdd")
         except: pass
-        try: acc += float(self.scope_mod(distance).AddTo["accuracyAdd"])
+        try: acc += c[2]("AddTo","accuracyAdd")
         except: pass
         return acc
     
-    def crit_chance(self, distance=10):
-        rcc = self.ammo_raw.Params.CriticalChancePercent
-        cc = _ip(distance, float(rcc["startDist"]), float(rcc["endDist"]), float(rcc["start"]), float(rcc["end"]))
-        try: cc += float(self.attack_type(distance).ModifiableParams["critChanceAdd"])
+    def _crit_chance(self, x, c):
+        ammo = self._ammo_record
+        cc = _ip(x, *[ammo("Params","CriticalChancePercent",p) for p in ("startDist","endDist","start","end")])
+        try: cc += c[0]("ModifiableParams","critChanceAdd")
         except: pass
-        try: cc += float(self.scope_mod(distance).AddTo["critChanceAdd"])
+        try: cc += c[2]("AddTo","critChanceAdd")
         except: pass
         return cc
     
-    def damage(self, distance=10):
-        rd = self.ammo_raw.Params.Damage
-        return _ip(distance, float(rd["startDist"]), float(rd["endDist"]), float(rd["start"]), float(rd["end"]))
+    def _damage(self, x, c):
+        return _ip(x, *[self._ammo_record("Params","Damage",p) for p in ("startDist","endDist","start","end")])
     
-    def followup_accuracy(self, distance=10):
-        try: return float(self.attack_type(distance).ModifiableParams["followupShotAccuracyAdd"])
+    def _followup_accuracy(self, x, c):
+        try: return c[0]("ModifiableParams","followupShotAccuracyAdd")
         except: return 0
     
-    def penetration(self, distance=10):
-        rp = self.ammo_raw.Params.ArmorPenetration
-        return _ip(distance, float(rp["startDist"]), float(rp["endDist"]), float(rp["start"]), float(rp["end"]))
+    def _penetration(self, x, c):
+        return _ip(x, *[self._ammo_record("Params","ArmorPenetration",p) for p in ("startDist","endDist","start","end")])
     
-    def pellets(self, distance=None): # distance is irrelevant, param is just for the common interface
+    def _pellets(self):
         try: return int(self.ammo_raw.Params["numPellets"]) # never used, but probably will be for shotgun slugs
         except: return int(self.weapon_raw.ModifiableParams["numPellets"])
     
-    def burst(self, distance=10):
+    def _burst(self, x, c):
         try:
-            atp = self.attack_type(distance).ModifiableParams
+            atp = c[0].element.ModifiableParams
             try: return int(atp["minShots"]), int(atp["maxShots"])
             except: return 1, 1 # Found but not set - use default
         except: return 0, 0
     
-    def ammo_capacity(self, distance=None, withChamber=True):
-        n = int(self.weapon_raw.ModifiableParams["roundsPerMagazine"])
-        if withChamber: n+=int(self.weapon_raw.ModifiableParams["closedBolt"])
-        return n
-    
-    def aim_time(self, distance=10):
-        try: minr, maxr = self.attack_ranges(distance)
+    def _aim_time(self, x, c):
+        try: minr, maxr = c[1]
         except: return inf
-        atp = self.attack_type(distance).ModifiableParams
-        at = _ip(distance, minr, maxr, float(atp["minAimTime"]), float(atp["maxAimTime"]))
+        at = _ip(x, minr, maxr, c[0]("ModifiableParams","minAimTime"), c[0]("ModifiableParams","maxAimTime"))
         try:
-            smod = self.scope_mod(distance)
-            at += _ip(distance, float(smod["minRange"]), float(smod["maxRange"]), float(smod.AddTo["minAimTime2"]), float(smod.AddTo["maxAimTime2"]))
+            smod = c[2]
+            at += _ip(x, smod("minRange"), smod("maxRange"), smod("AddTo","minAimTime2"), smod("AddTo","maxAimTime2"))
         except: pass
         return at
     
-    def reset_time(self, distance=10):
-        try: rt = float(self.attack_type(distance).ModifiableParams["resetTime"])
+    def _reset_time(self, x, c):
+        try: rt = c[0]("ModifiableParams","resetTime")
         except: rt = 0
-        try: rt += float(self.scope_mod(distance).AddTo["resetTime"])
+        try: rt += c[2]("AddTo","resetTime")
         except: pass
         return rt
     
-    def cycle_time(self, distance=10):
-        try: return 1000.0/float(self.attack_type(distance).ModifiableParams["roundsPerSecondOverride"])
-        except: return 1000.0/float(self.ammo_raw.Params["roundsPerSecond"])
+    def _cycle_time(self, x, c):
+        try: return 1000.0/c[0]("ModifiableParams","roundsPerSecondOverride")
+        except: return 1000.0/self._ammo_record("Params","roundsPerSecond")
     
-    # For the following params, distance is also irrelevant
-    def guard_time(self, distance=None):
-        gt = float(self.weapon_raw.ModifiableParams["guardTime"])
-        try: gt += float(self.scope_raw.EquipmentModifier.AddTo["guardTime"])
+    def _equipment_time(self, param): # Weapon handling times, plus the scope's modifier
+        t = self._weapon_record("ModifiableParams",param)
+        try: t += self._scope_record("EquipmentModifier","AddTo",param)
         except: pass
-        return gt
+        return t
     
-    def ready_time(self, distance=None):
-        rt = float(self.weapon_raw.ModifiableParams["readyTime"])
-        try: rt += float(self.scope_raw.EquipmentModifier.AddTo["readyTime"])
-        except: pass
-        return rt
+# Memoization: LRUCache keeps the results of the most recent calls, memoize puts one in front of a function (or method), and Cached in front of every method of an object
+# Calls are matched by the values of all parameters, however they are passed (positional, keyword or default), and lists count as tuples (e.g. armor=[4,40])
+# Results are shared between all calls with the same arguments, so they must not be changed (Events never are, except by cap() and normalize())
+class LRUCache:
+    def __init__(self, maxsize=4096): # maxsize=None: no limit
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits, self.misses, self.evictions = 0, 0, 0
     
-    def reload_time(self, distance=None):
-        rt = float(self.weapon_raw.ModifiableParams["reloadTime"])
-        try: rt += float(self.scope_raw.EquipmentModifier.AddTo["reloadTime"])
-        except: pass
-        return rt
+    def __len__(self):
+        return len(self._entries)
     
-    def reload_empty_time(self, distance=None):
-        rte = float(self.weapon_raw.ModifiableParams["reloadEmptyTime"])
-        try: rte += float(self.scope_raw.EquipmentModifier.AddTo["reloadEmptyTime"])
-        except: pass
-        return rte
+    def get(self, key, compute, *args, **kwargs): # The result for key, from compute(*args, **kwargs) if it isn't stored
+        try:
+            value = self._entries[key]
+        except KeyError:
+            self.misses += 1
+            value = compute(*args, **kwargs)
+            self._entries[key] = value
+            if self.maxsize is not None:
+                while len(self._entries)>self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            return value
+        except TypeError: # Something unhashable (e.g. a NumPy array) in it; just calculate
+            self.misses += 1
+            return compute(*args, **kwargs)
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def discard(self, key): # Forget one result, e.g. one that turned out to be an error
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        self._entries.clear()
     
+    def info(self):
+        return {"hits":self.hits, "misses":self.misses, "evictions":self.evictions, "size":len(self._entries), "maxsize":self.maxsize}
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)): return tuple(_hashable(v) for v in value)
+    if isinstance(value, dict): return tuple(sorted((k,_hashable(v)) for k,v in value.items()))
+    return value
+
+class _Arguments: # Turns the arguments of a call into the values of all parameters, as a key for LRUCache
+    def __init__(self, function):
+        self.signature = inspect.signature(function)
+        parameters = self.signature.parameters.values()
+        self.simple = all(p.kind==p.POSITIONAL_OR_KEYWORD for p in parameters)
+        self.defaults = tuple(p.default for p in parameters)
+    
+    def key(self, args, kwargs):
+        if not kwargs and self.simple and len(args)<=len(self.defaults): # The common case, without going through inspect
+            key = args+self.defaults[len(args):]
+            try:
+                hash(key)
+                return key
+            except TypeError: pass
+        bound = self.signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        return tuple(_hashable(v) for v in bound.arguments.values())
+
+def memoize(maxsize=4096): # Decorator; the cache is available as function.cache (e.g. function.cache.info())
+    def decorator(function):
+        arguments, cache = _Arguments(function), LRUCache(maxsize)
+        @wraps(function)
+        def memoized(*args, **kwargs):
+            return cache.get(arguments.key(args, kwargs), function, *args, **kwargs)
+        memoized.cache = cache
+        return memoized
+    return decorator
+
 class Cached: # Parsing every single call form XML is too slow; caching is more efficient.
-    def __init__(self, calculator):
+    _arguments = {} # By class and method, since every instance has the same
+    
+    def __init__(self, calculator, maxsize=4096):
         self._calculator = calculator
-        self._cache = {}
+        self._cache = LRUCache(maxsize)
     
     def empty_cache(self):
-        self.cache = {}
+        self._cache.clear()
+    
+    def cache_info(self):
+        return self._cache.info()
+    
+    def __eq__(self, other): # Same results as the wrapped object, so memoized functions treat them as the same argument
+        return self._calculator==(other._calculator if isinstance(other, Cached) else other)
+    
+    def __hash__(self):
+        return hash(self._calculator)
         
     def __getattr__(self, attr):
-        def method(*args):
-            key = (attr,*args)
-            if not key in self._cache:
-                self._cache[key] = getattr(self._calculator,attr)(*args)
-            return self._cache[key]
+        if attr.startswith("_"): raise AttributeError(attr)
+        function = getattr(self._calculator, attr)
+        kind = (type(self._calculator), attr)
+        if kind not in Cached._arguments: Cached._arguments[kind] = _Arguments(function)
+        arguments = Cached._arguments[kind]
+        def method(*args, **kwargs):
+            return self._cache.get((attr,)+arguments.key(args, kwargs), function, *args, **kwargs)
+        setattr(self, attr, method) # Found directly from now on, without coming back here
         return method